@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""Produce content-hashed and precompressed copies of the webpack output for production asset mode
+
+Usage: build_assets.py [jsdist_dir]"""
+import gzip
+import hashlib
+import json
+import os
+import sys
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ASSETS = ('bundle.js',)
+
+
+def build(root):
+    manifest = {}
+    for name in ASSETS:
+        with open(os.path.join(root, name), 'rb') as fp:
+            data = fp.read()
+        base, ext = os.path.splitext(name)
+        hashed = "{}.{}{}".format(base, hashlib.sha256(data).hexdigest()[:12], ext)
+        with open(os.path.join(root, hashed), 'wb') as fp:
+            fp.write(data)
+        with open(os.path.join(root, hashed + '.gz'), 'wb') as fp:
+            fp.write(gzip.compress(data, 9))
+        if brotli:
+            with open(os.path.join(root, hashed + '.br'), 'wb') as fp:
+                fp.write(brotli.compress(data, quality=11))
+        else:
+            print("brotli not installed, only gzip copy made")
+        manifest[name] = hashed
+        print("{} -> {}".format(name, hashed))
+    with open(os.path.join(root, 'manifest.json'), 'wt') as fp:
+        json.dump(manifest, fp, indent=2)
+
+
+if __name__ == '__main__':
+    build(sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), 'jsdist'))
@@ -0,0 +1,77 @@
+import json
+
+from tornado.websocket import WebSocketClosedError
+
+from .decorators import log_exceptions
+from .mixins import LoggerMixin
+
+
+class WebsocketBroker(LoggerMixin, object):
+    """Keeps track of connected websocket clients and fans messages out to all of them.
+
+    Messages are serialized once per broadcast and the same bytes written to every client, clients that do not
+    keep up (more than max_buffer bytes unacknowledged) get disconnected instead of buffering forever."""
+    clients = {}
+    max_clients = 20
+    max_buffer = 1024 * 1024
+
+    def __init__(self, *args, **kwargs):
+        self.max_clients = kwargs.pop('max_clients', self.max_clients)
+        self.max_buffer = kwargs.pop('max_buffer', self.max_buffer)
+        super().__init__(*args, **kwargs)
+        self.clients = {}  # handler -> bytes written but not yet flushed
+
+    def register(self, client):
+        """Add client, returns False if we're full"""
+        if len(self.clients) >= self.max_clients:
+            self.logger.warning("Refusing websocket client, already have {}".format(len(self.clients)))
+            return False
+        self.clients[client] = 0
+        self.logger.debug("{} websocket clients".format(len(self.clients)))
+        return True
+
+    def unregister(self, client):
+        self.clients.pop(client, None)
+        self.logger.debug("{} websocket clients".format(len(self.clients)))
+
+    @log_exceptions
+    def send(self, client, data):
+        """Write pre-serialized data (bytes) to client, keeping count of what is still in flight"""
+        if client not in self.clients:
+            return
+        if self.clients[client] + len(data) > self.max_buffer:
+            self.logger.warning("Websocket client {} is not keeping up, disconnecting".format(client.request.remote_ip))
+            self.unregister(client)
+            client.close(1008, "Write buffer limit exceeded")
+            return
+        try:
+            future = client.write_message(data)
+        except WebSocketClosedError:
+            self.unregister(client)
+            return
+        self.clients[client] += len(data)
+        future.add_done_callback(lambda f: self._write_done(client, len(data), f))
+
+    def send_message(self, client, message):
+        """Serialize message and send it to single client, subject to the same buffer limit as broadcasts"""
+        self.send(client, json.dumps(message).encode('utf-8'))
+
+    def _write_done(self, client, size, future):
+        """Write finished, retrieve the outcome (unretrieved exceptions get logged by asyncio) and forget clients
+        that dropped mid-write"""
+        if future.cancelled() or future.exception():
+            self.unregister(client)
+            return
+        if client in self.clients:
+            self.clients[client] -= size
+
+    @log_exceptions
+    def broadcast(self, message, exclude=None):
+        """Serialize message once and send it to every client (except exclude)"""
+        if not self.clients:
+            return
+        data = json.dumps(message).encode('utf-8')
+        for client in list(self.clients.keys()):
+            if client is exclude:
+                continue
+            self.send(client, data)
@@ -51,8 +51,9 @@ def usage(binname):
     """.format(binname))
 
 
-def main(binname, controller_klass, autorun=True, override_usage=None, eventloop=None):
-    """Boilerplate main-function"""
+def main(binname, controller_klass, autorun=True, override_usage=None, eventloop=None, config_name=None):
+    """Boilerplate main-function, config_name (default: program name) is the config root key and default
+    config file prefix, for helper programs sharing the main program's configuration"""
     logging.config.dictConfig(LOGGING)
 
     if not eventloop:
@@ -69,8 +70,11 @@ def main(binname, controller_klass, autorun=True, override_usage=None, eventloop
             usage(binname)
         sys.exit(0)
 
+    pgm_name = os.path.basename(binname).replace('.py', '')
+    if not config_name:
+        config_name = pgm_name
     if len(sys.argv) < 2:
-        config_file = binname.replace('.py', '_config.json')
+        config_file = os.path.join(os.path.dirname(binname), config_name + '_config.json')
     else:
         config_file = sys.argv[1]
 
@@ -82,10 +86,9 @@ def main(binname, controller_klass, autorun=True, override_usage=None, eventloop
         print("File {} does not exist".format(config_file))
         sys.exit(errno.ENOENT)
 
-    pgm_name = os.path.basename(binname).replace('.py', '')
     instance = controller_klass(
         mainloop=eventloop,
-        config_root_name=pgm_name,
+        config_root_name=config_name,
         config_file=config_file,
         logger_name=pgm_name,
     )
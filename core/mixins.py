@@ -61,6 +61,7 @@ class LoggerMixin(ReloadMixin):
 
 class ConfigMixin(LoggerMixin):
     config = {}
+    previous_config = {}
     config_file = None
     config_root_name = None
 
@@ -79,6 +80,7 @@ class ConfigMixin(LoggerMixin):
         then populates self.config accordingly.
 
         Due to the config-file reloading being usually first thing required, we do it before calling parents reload method"""
+        self.previous_config = self.config
         self.logger.info("Loading configuration from {}".format(self.config_file))
         with open(self.config_file) as f:
             config = json.load(f)
@@ -89,6 +91,24 @@ class ConfigMixin(LoggerMixin):
                 self.config = config
         super(ConfigMixin, self).reload(*args, **kwargs)
 
+    def config_changed(self, *keys):
+        """Check if any of the given keys changed in the last reload (always True on first load), nested keys
+        are given dotted, e.g. 'motors.max_speed'"""
+        if not self.previous_config:
+            return True
+        for key in keys:
+            if self._config_value(self.previous_config, key) != self._config_value(self.config, key):
+                return True
+        return False
+
+    @staticmethod
+    def _config_value(config, key):
+        for part in key.split('.'):
+            if not isinstance(config, dict):
+                return None
+            config = config.get(part)
+        return config
+
 
 class TimersMixin(LoggerMixin, CleanupMixin):
     """Mixin to implement handling of multiple periodic timers"""
@@ -0,0 +1,59 @@
+import json
+import mimetypes
+import os
+import re
+
+import tornado.web
+
+# bundle.0123abcd.js style names produced by build_assets.py, content never changes under the same name
+HASHED_NAME = re.compile(r'\.[0-9a-f]{8,}\.[a-z0-9]+$')
+ENCODINGS = (
+    ('br', '.br'),
+    ('gzip', '.gz'),
+)
+
+
+class PrecompressedStaticFileHandler(tornado.web.StaticFileHandler):
+    """Serves foo.js.br / foo.js.gz next to foo.js when the client accepts it, content-hashed files are cached
+    forever by the browser"""
+    encoding = None
+    original_path = None
+
+    async def get(self, path, include_body=True):
+        self.encoding = None
+        self.original_path = path
+        accept = self.request.headers.get('Accept-Encoding', '')
+        for encoding, ext in ENCODINGS:
+            if encoding in accept and os.path.isfile(os.path.join(self.root, path + ext)):
+                self.encoding = encoding
+                path = path + ext
+                break
+        self.set_header('Vary', 'Accept-Encoding')
+        if self.encoding:
+            self.set_header('Content-Encoding', self.encoding)
+        await super().get(path, include_body)
+
+    def get_content_type(self):
+        """Type of the uncompressed file, not application/x-brotli"""
+        if self.encoding:
+            mime_type, _ = mimetypes.guess_type(self.original_path)
+            return mime_type or 'application/octet-stream'
+        return super().get_content_type()
+
+    def get_cache_time(self, path, modified, mime_type):
+        if HASHED_NAME.search(self.original_path or path):
+            return self.CACHE_MAX_AGE
+        return super().get_cache_time(path, modified, mime_type)
+
+    def set_extra_headers(self, path):
+        if HASHED_NAME.search(self.original_path or path):
+            self.set_header('Cache-Control', 'public, max-age={}, immutable'.format(self.CACHE_MAX_AGE))
+
+
+def load_manifest(root):
+    """Map of logical asset name -> hashed file name, empty if assets have not been built"""
+    path = os.path.join(root, 'manifest.json')
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'rt') as fp:
+        return json.load(fp)
@@ -185,6 +185,9 @@ class Main extends React.Component {
                 case "sequence":
                     me.setState({ sequence: msg.sequence});
                     break;
+                case "sequence_errors":
+                    alert("Sequence not saved:\n" + msg.errors.join("\n"));
+                    break;
             }
         }
     }
@@ -1,30 +1,65 @@
 #!/usr/bin/env python3
 """Server to talk to xbee radios to control the linear actuators and to web client"""
+import hashlib
 import json
 import os
+import time
 
 import serial
+import tornado.concurrent
+import tornado.ioloop
 import tornado.web
 import tornado.websocket
 
 from core import main
+from core.broker import WebsocketBroker
 from core.decorators import log_exceptions
 from core.mixins import ConfigMixin, ControllerMixin, TimersMixin, ZMQMixin
-from motorhelpers import KaraMoottori
-from sequencer import Sequence
+from core.static import PrecompressedStaticFileHandler, load_manifest
+from motorhelpers import BatchCommand, KaraMoottori
+from sequencer import SequenceCompiler, SequenceRunner, sequence_groups, validate_sequence
+from telemetry import TelemetryLog, TelemetryReplay
 from xbeehandlers import xbee_handler
+from xbeehandlers.remote import RX_TOPIC, RemoteXBee, unpack_frame
 
 template_root = os.path.join(os.path.dirname(__file__), 'templates')
 js_root = os.path.join(os.path.dirname(__file__), 'jsdist')
 
 
 class MainHandler(ControllerMixin, tornado.web.RequestHandler):
-    """Returns our index.html, rendered via template engine"""
+    """Returns our index.html, rendered via template engine (only once in production asset mode)"""
 
     def get(self):
-        self.render(
+        if self.controller.index_cache:
+            self.write(self.controller.index_cache)
+            return
+        html = self.render_string(
             "index.html",
+            bundle=self.controller.asset_manifest.get('bundle.js', 'bundle.js'),
         )
+        if self.controller.production_assets:
+            self.controller.index_cache = html
+        self.write(html)
+
+
+class BatchHandler(ControllerMixin, tornado.web.RequestHandler):
+    """REST endpoint for batch motor commands, POST {"commands": [...], "timeout": 30}"""
+
+    async def post(self):
+        try:
+            msg = json.loads(self.request.body)
+        except ValueError:
+            self.set_status(400)
+            self.write({'type': 'batch', 'ok': False, 'errors': ['body is not valid JSON']})
+            return
+        if not isinstance(msg, dict):
+            self.set_status(400)
+            self.write({'type': 'batch', 'ok': False, 'errors': ['body must be an object']})
+            return
+        reply = await self.controller.run_batch(msg.get('commands'), msg.get('timeout'))
+        if reply.get('errors'):
+            self.set_status(400)
+        self.write(reply)
 
 
 class MotorWebsocketHandler(tornado.websocket.WebSocketHandler):
@@ -39,11 +74,14 @@ class MotorWebsocketHandler(tornado.websocket.WebSocketHandler):
     def open(self, *args, **kwargs):
         """new WS connection"""
         self.logger.info("New WS stream handled by %s, args=%s kwargs=%s" % (self.__class__.__name__, repr(args), repr(kwargs)))
+        if not self.controller.broker.register(self):
+            self.close(1013, "Too many clients")
 
     @log_exceptions
     def on_close(self, *args, **kwargs):
         """Connection closed"""
         self.logger.debug("WS stream closed, args=%s kwargs=%s" % (repr(args), repr(kwargs)))
+        self.controller.broker.unregister(self)
 
     @log_exceptions
     def check_origin(self, origin):
@@ -56,24 +94,40 @@ class MotorWebsocketHandler(tornado.websocket.WebSocketHandler):
         """Got message"""
         self.logger.debug("got message {}".format(message))
         msg = json.loads(message)
-        self.write_message(json.dumps({'type': 'pong'}))
+        broker = self.controller.broker
+        broker.send_message(self, {'type': 'pong'})
         if 'cmd' in msg:
             if msg['cmd'] == 'get_sequence':
-                with open(self.controller.config['sequence_file'], 'rt') as fp:
-                    sequence_config = json.load(fp)
-                reply = {
-                    'type': 'sequence',
-                    'sequence': sequence_config,
-                }
                 self.logger.info("Sending back sequence")
-                self.write_message(json.dumps(reply))
+                broker.send_message(self, self.controller.sequence_message())
+
+            if msg['cmd'] == 'get_stats':
+                broker.send_message(self, {
+                    'type': 'stats',
+                    'stats': self.controller.sequencer.stats() if self.controller.sequencer else {},
+                })
+
+            if msg['cmd'] == 'batch':
+                future = self.controller.run_batch(msg.get('commands'), msg.get('timeout'))
+                tornado.ioloop.IOLoop.current().add_future(future, self.batch_done)
 
             if msg['cmd'] == 'save_sequence':
+                sequence_config = msg['sequence']
+                errors = validate_sequence(sequence_config, self.controller.known_motors())
+                if errors:
+                    self.logger.warning("Not saving invalid sequence")
+                    broker.send_message(self, {'type': 'sequence_errors', 'errors': errors})
+                    return
                 with open(self.controller.config['sequence_file'], 'wt') as fp:
-                    sequence_config = msg['sequence']
                     json.dump(sequence_config, fp, separators=(',', ' : '), indent=2)
+                # Broadcasts the new sequence to everyone
                 self.controller.sequence_reload()
 
+    @log_exceptions
+    def batch_done(self, future):
+        """Send the aggregated batch reply, the broker drops it if client left meanwhile"""
+        self.controller.broker.send_message(self, future.result())
+
 
 class KaraCRTL(ConfigMixin, ZMQMixin, TimersMixin):
     xbeehandler = None
@@ -81,12 +135,24 @@ class KaraCRTL(ConfigMixin, ZMQMixin, TimersMixin):
     motors = {}
     sequencer = None
     seqtimer = None
+    http_server = None
+    telemetry = None
+    replay = None
+    production_assets = False
+    asset_manifest = {}
+    index_cache = None
+    wait_started = 0
+    sequence_digest = None  # sha256 of the sequence file the running show was loaded from
+    radio_retry_handle = None
+    radio_retry_delay = 1.0
 
     def __init__(self, *args, **kwargs):
         self.mainloop = kwargs.pop('mainloop')
         if not self.mainloop:
             raise RuntimeError('"mainloop" must be provided to __init__')
         super().__init__(*args, **kwargs)
+        self.compiler = SequenceCompiler(logger_name=self.logger_name)
+        self.broker = WebsocketBroker(logger_name=self.logger_name)
         self.reload()
 
     def hook_signals(self):
@@ -101,64 +167,383 @@ class KaraCRTL(ConfigMixin, ZMQMixin, TimersMixin):
 
     @log_exceptions
     def wait_for_motors(self):
-        all_found = True
-        for mkey in self.config['motors']['wait_for']:
-            if mkey not in self.motors:
-                all_found = False
+        """Start the sequence once the motors we wait for are present, or according to the wait policy
+        once motors_config['wait_timeout'] has passed"""
+        wait_for = self.config['motors']['wait_for']
+        present = []
+        for mkey in wait_for:
+            if not self.motor_present(mkey):
                 self.logger.debug("{} is NOT present".format(mkey))
             else:
                 self.logger.debug("{} is PRESENT".format(mkey))
-        if not all_found:
-            return
+                present.append(mkey)
+        if len(present) < len(wait_for):
+            timeout = self.config['motors'].get('wait_timeout', 0)
+            if not timeout or (time.time() - self.wait_started) < timeout:
+                return
+            if self.config['motors'].get('start_with_available', False):
+                quorum = 1
+            else:
+                quorum = self.config['motors'].get('wait_quorum', len(wait_for))
+            if len(present) < quorum:
+                return
+            self.logger.warning("Gave up waiting for {}, starting with {}".format(
+                ", ".join(set(wait_for) - set(present)),
+                ", ".join(present)
+            ))
         self.sequence_reload()
 
+    def motor_present(self, mkey):
+        """Motor has been seen on the network, ones only preloaded from the node cache don't count yet"""
+        return mkey in self.motors and self.motors[mkey].node.verified
+
+    def known_motors(self):
+        """Motors a sequence may refer to, the ones we wait for and whatever else has been discovered"""
+        return set(self.config['motors']['wait_for']) | set(self.motors.keys())
+
     @log_exceptions
     def sequence_reload(self):
+        """(Re-)start the sequence from sequence_file, returns list of errors if it does not validate.
+
+        Motors that have not been discovered (yet) are only warned about, steps skip them until they show up"""
+        compiled = self.compiler.load(
+            self.config['sequence_file'],
+            None,
+            self.config['motors'],
+            self.config.get('trajectory')
+        )
         self.seqtimer.stop()
+        if compiled.errors:
+            for error in compiled.errors:
+                self.logger.error("Sequence error: {}".format(error))
+            if self.sequencer and not self.sequencer.done:
+                self.logger.warning("Keeping the current sequence running")
+                self.seqtimer = self.add_timer(self._iterate_sequencer, self.config['sequence_timer'])
+            else:
+                # Nothing running, try again in case the file gets fixed
+                self.seqtimer = self.add_timer(self.wait_for_motors, 5000)
+            return compiled.errors
+        unknown = self.sequence_motors(compiled.config) - self.known_motors()
+        if unknown:
+            self.logger.warning("Sequence uses motors not discovered yet: {}".format(", ".join(sorted(unknown))))
+        digest = self.sequence_file_digest()
+        if digest != self.sequence_digest:
+            # Saved via websocket, edited on disk or sequence_file changed, everyone is looking at a stale copy
+            self.sequence_digest = digest
+            self.broker.broadcast(self.sequence_message())
+        if self.sequencer:
+            self.sequencer.stop()
         self.sequencer = None
-        with open(self.config['sequence_file'], 'rt') as fp:
-            sequence_config = json.load(fp)
         for mkey in self.motors.keys():
             self.motors[mkey].stop()
-        self.sequencer = Sequence(
-            sequence_config,
+        self.sequencer = SequenceRunner(
+            compiled.config,
             self.motors,
+            motors_config=self.config['motors'],
+            trajectory_config=self.config.get('trajectory'),
+            plans=compiled.plans,
+            lookahead=self.config.get('sequence_lookahead', 2),
+            wakeup=self._iterate_sequencer,
+            faults_config=self.config.get('faults'),
             logger_name=self.logger_name
         )
         self.seqtimer = self.add_timer(self._iterate_sequencer, self.config['sequence_timer'])
 
+    def sequence_motors(self, sequenceconfig):
+        """Every motor the (validated) sequence refers to"""
+        ret = set()
+        for groupconfig in sequence_groups(sequenceconfig).values():
+            ret.update(groupconfig.get('motors', []))
+            for step in groupconfig['steps']:
+                ret.update(step['motors'].keys())
+        return ret
+
+    def sequence_message(self):
+        """The sequence file as websocket message"""
+        with open(self.config['sequence_file'], 'rt') as fp:
+            sequence_config = json.load(fp)
+        return {
+            'type': 'sequence',
+            'sequence': sequence_config,
+        }
+
+    def sequence_file_digest(self):
+        try:
+            with open(self.config['sequence_file'], 'rb') as fp:
+                return hashlib.sha256(fp.read()).hexdigest()
+        except OSError:
+            return None
+
     @log_exceptions
     def _iterate_sequencer(self):
         if self.sequencer.done:
-            self.self.seqtimer.stop()
+            self.seqtimer.stop()
+            return
         self.sequencer.iterate()
 
     @log_exceptions
     def reload(self, *args, **kwargs):
+        """(Re-)read config and restart only the subsystems whose settings changed, a running show and the
+        connected web clients survive e.g. a sequence_timer tweak"""
         super().reload(*args, **kwargs)
-        if self.xbeehandler:
-            self.xbeehandler.quit()
-            self.motors = {}
-        if 'disable' in self.config['serial'] and self.config['serial']['disable']:
-            self.logger.warning("*** Serial port disabled ***")
+
+        if self.config_changed('http_server_port', 'tornado_debug', 'assets'):
+            self.reload_http()
+        websocket_config = self.config.get('websocket', {})
+        self.broker.max_clients = websocket_config.get('max_clients', WebsocketBroker.max_clients)
+        self.broker.max_buffer = websocket_config.get('max_buffer', WebsocketBroker.max_buffer)
+        if websocket_config.get('status_interval'):
+            self.add_timer(self.broadcast_status, websocket_config['status_interval'])
+        self.add_timer(self.expire_cached_nodes, 5000)
+
+        if self.config_changed('motors'):
+            for motor in self.motors.values():
+                motor.config = self.config['motors']
+
+        if self.config_changed('serial', 'node_cache_file', 'telemetry', 'radio'):
+            self.reload_radio()
+        elif self.radio_process_mode() and self.xbeehandler and not self.replay:
+            # ZMQMixin closed our sockets, keep the handler (and its node table) and just listen again
+            self.subscribe(self.config['radio']['rx_socket'], RX_TOPIC, self.radio_process_rx)
+        # Changing these invalidates the running show, others (e.g. sequence_timer, report intervals) just get
+        # picked up
+        sequence_keys = (
+            'motors.max_steps',
+            'motors.max_speed',
+            'sequence_file',
+            'sequence_lookahead',
+            'trajectory',
+            'faults'
+        )
+        if (self.config_changed(*sequence_keys) or not self.sequencer
+                or self.sequence_file_digest() != self.sequence_digest):
+            self.wait_started = time.time()
+            self.seqtimer = self.add_timer(self.wait_for_motors, 500)
         else:
-            if 'disable' in self.config['serial']:
-                del(self.config['serial']['disable'])
-            self.serialport = serial.Serial(**self.config['serial'])
-            self.xbeehandler = xbee_handler(
-                self.serialport,
-                logger_name=self.logger_name
-            )
-            self.xbeehandler.new_node_callbacks.append(self.new_xbee_node)
-        self.seqtimer = self.add_timer(self.wait_for_motors, 500)
+            # TimersMixin cleared the timers, pick up where we left off (at the possibly changed interval)
+            self.logger.info("Sequence settings unchanged, continuing")
+            self.seqtimer = self.add_timer(self._iterate_sequencer, self.config['sequence_timer'])
 
+    @log_exceptions
+    def reload_http(self):
+        """(Re-)bind the web server"""
+        if self.http_server:
+            self.logger.info("Unbinding from port %d" % self.previous_config['http_server_port'])
+            self.http_server.stop()
+        self.production_assets = bool(self.config.get('assets', {}).get('production', False))
+        self.index_cache = None
+        app_settings = {
+            'template_path': template_root,
+            'debug': self.config['tornado_debug'],
+        }
+        if self.production_assets:
+            if self.config['tornado_debug']:
+                self.logger.warning("Production asset mode, ignoring tornado_debug")
+            self.asset_manifest = load_manifest(js_root)
+            if not self.asset_manifest:
+                self.logger.warning("No asset manifest in {}, run build_assets.py".format(js_root))
+            app_settings.update({
+                'debug': False,
+                'compiled_template_cache': True,
+                'static_hash_cache': True,
+            })
+            static_handler = PrecompressedStaticFileHandler
+        else:
+            self.asset_manifest = {}
+            static_handler = tornado.web.StaticFileHandler
         self.ws_app = tornado.web.Application([
             (r'/', MainHandler, {'controller': self}),
             (r'/ws/?', MotorWebsocketHandler, {'controller': self}),
-            (r'/js/(.*)', tornado.web.StaticFileHandler, {'path': js_root}),
-        ], template_path=template_root, debug=self.config['tornado_debug'])
+            (r'/api/batch/?', BatchHandler, {'controller': self}),
+            (r'/js/(.*)', static_handler, {'path': js_root}),
+        ], **app_settings)
         self.logger.info("Binding to port %d" % self.config['http_server_port'])
-        self.ws_app.listen(self.config['http_server_port'])
+        self.http_server = self.ws_app.listen(self.config['http_server_port'])
+
+    @log_exceptions
+    def reload_radio(self):
+        """Restart serial port and xbee handler, motor objects are kept and get re-attached as nodes show up"""
+        self.cancel_radio_retries()
+        if self.xbeehandler:
+            self.xbeehandler.quit()
+            self.xbeehandler = None
+        if self.replay:
+            self.replay.stop()
+            self.replay = None
+        telemetry_config = self.config.get('telemetry', {})
+        if self.config_changed('telemetry') or telemetry_config.get('replay'):
+            self.close_telemetry()
+        # Opening the log rotates it, in replay mode that would move away the very file we're about to replay
+        if telemetry_config.get('file') and not telemetry_config.get('replay') and not self.telemetry:
+            self.telemetry = TelemetryLog(
+                telemetry_config['file'],
+                max_size=telemetry_config.get('max_size', 16 * 1024 * 1024),
+                backups=telemetry_config.get('backups', 3),
+                logger_name=self.logger_name
+            )
+        # Radio and motors come up in the background, UI is usable right away
+        self.radio_retry_delay = self.config.get('radio_retry', {}).get('initial', 1.0)
+        self.mainloop.add_callback(self.connect_radio)
+
+    def cancel_radio_retries(self):
+        """Cancel pending connect/discovery retries"""
+        if self.radio_retry_handle:
+            self.mainloop.remove_timeout(self.radio_retry_handle)
+            self.radio_retry_handle = None
+
+    def schedule_radio_retry(self, callback):
+        """Call callback after current backoff delay and double the delay for next time"""
+        self.cancel_radio_retries()
+        max_delay = self.config.get('radio_retry', {}).get('max', 30.0)
+        self.logger.debug("Retrying {} in {:0.1f}s".format(callback.__name__, self.radio_retry_delay))
+        self.radio_retry_handle = self.mainloop.call_later(self.radio_retry_delay, callback)
+        self.radio_retry_delay = min(self.radio_retry_delay * 2, max_delay)
+
+    @log_exceptions
+    def connect_radio(self):
+        """Open the serial port and start the xbee handler, retrying with backoff if the port is not there"""
+        self.radio_retry_handle = None
+        if self.config.get('telemetry', {}).get('replay'):
+            return self.start_replay()
+        if self.radio_process_mode():
+            return self.connect_radio_process()
+        serial_config = dict(self.config['serial'])
+        if serial_config.pop('disable', False):
+            self.logger.warning("*** Serial port disabled ***")
+            return
+        try:
+            self.serialport = serial.Serial(**serial_config)
+        except (serial.SerialException, OSError) as e:
+            self.logger.error("Could not open serial port: {}".format(e))
+            self.schedule_radio_retry(self.connect_radio)
+            return
+        self.xbeehandler = xbee_handler(
+            self.serialport,
+            cache_file=self.config.get('node_cache_file'),
+            telemetry=self.telemetry,
+            logger_name=self.logger_name
+        )
+        self.xbeehandler.new_node_callbacks.append(self.new_xbee_node)
+        self.xbeehandler.expired_node_callbacks.append(self.expired_xbee_node)
+        self.xbeehandler.preload_cache()
+        self.radio_retry_delay = self.config.get('radio_retry', {}).get('initial', 1.0)
+        self.schedule_radio_retry(self.rediscover_motors)
+
+    def radio_process_mode(self):
+        return self.config.get('radio', {}).get('mode') == 'process'
+
+    @log_exceptions
+    def connect_radio_process(self):
+        """Talk to the radio via karactrl_radio.py running in its own process, so nothing happening here can delay
+        the serial I/O"""
+        radio_config = self.config['radio']
+        self.logger.info("Using radio process via {} / {}".format(radio_config['rx_socket'], radio_config['tx_socket']))
+        self.xbeehandler = xbee_handler(
+            None,
+            xbee=RemoteXBee(self.publish, radio_config['tx_socket']),
+            cache_file=self.config.get('node_cache_file'),
+            telemetry=self.telemetry,
+            logger_name=self.logger_name
+        )
+        self.xbeehandler.new_node_callbacks.append(self.new_xbee_node)
+        self.xbeehandler.expired_node_callbacks.append(self.expired_xbee_node)
+        self.xbeehandler.preload_cache()
+        self.subscribe(radio_config['rx_socket'], RX_TOPIC, self.radio_process_rx)
+        # The first discovery likely got lost while the PUB socket was still connecting
+        self.radio_retry_delay = self.config.get('radio_retry', {}).get('initial', 1.0)
+        self.schedule_radio_retry(self.rediscover_motors)
+
+    @log_exceptions
+    def radio_process_rx(self, frames):
+        """Packet relayed from the radio process"""
+        if not self.xbeehandler:
+            return
+        _, payload = frames
+        self.xbeehandler.xbee_callback(unpack_frame(payload))
+
+    @log_exceptions
+    def start_replay(self):
+        """Run on recorded traffic instead of the radio, for post-mortems and reproducible testing"""
+        telemetry_config = self.config['telemetry']
+        self.logger.warning("*** Replaying {} instead of using serial port ***".format(telemetry_config['replay']))
+        self.xbeehandler = xbee_handler(
+            None,
+            logger_name=self.logger_name
+        )
+        self.xbeehandler.new_node_callbacks.append(self.new_xbee_node)
+        self.replay = TelemetryReplay(
+            telemetry_config['replay'],
+            self.xbeehandler.xbee_callback,
+            self.mainloop,
+            speed=telemetry_config.get('replay_speed', 1.0),
+            logger_name=self.logger_name
+        )
+        self.replay.start()
+
+    @log_exceptions
+    def close_telemetry(self):
+        if self.replay:
+            self.replay.stop()
+            self.replay = None
+        if self.telemetry:
+            self.telemetry.close()
+            self.telemetry = None
+
+    @log_exceptions
+    def rediscover_motors(self):
+        """Re-run node discovery with backoff for as long as some of the motors we wait for are missing or some
+        nodes from the cache have not been verified (expiring them needs a discovery round)"""
+        self.radio_retry_handle = None
+        if not self.xbeehandler:
+            return
+        missing = [mkey for mkey in self.config['motors']['wait_for'] if not self.motor_present(mkey)]
+        unverified = [node.node_identifier.decode('utf-8')
+                      for node in self.xbeehandler.nodes_by_identifier.values() if not node.verified]
+        if not missing and not unverified:
+            return
+        self.logger.info("Still missing {}, rediscovering".format(", ".join(sorted(set(missing + unverified)))))
+        self.xbeehandler.discover_nodes()
+        self.schedule_radio_retry(self.rediscover_motors)
+
+    @log_exceptions
+    def expire_cached_nodes(self):
+        """Forget cached nodes that never showed up, runs on its own timer"""
+        if self.xbeehandler:
+            self.xbeehandler.expire_unverified(self.config.get('node_cache_verify_timeout', 60))
+
+    @log_exceptions
+    def broadcast_status(self):
+        """Push motor states to all websocket clients"""
+        if not self.broker.clients:
+            return
+        self.broker.broadcast({
+            'type': 'status',
+            'motors': {
+                mkey: {
+                    'ready': motor.ready,
+                    'homing': motor.homing,
+                    'position': motor.current_pos,
+                    'target': motor.target_pos,
+                } for mkey, motor in self.motors.items()
+            },
+        })
+
+    @log_exceptions
+    def run_batch(self, commands, timeout=None):
+        """Validate and send a batch of motor commands, returns Future for the aggregated reply which resolves
+        when all involved motors are ready (or immediately with the errors if the batch is not valid)"""
+        batch = BatchCommand(commands, self.motors, timeout=timeout, logger_name=self.logger_name)
+        errors = batch.validate()
+        if errors:
+            self.logger.warning("Rejected batch: {}".format("; ".join(errors)))
+            future = tornado.concurrent.Future()
+            future.set_result({'type': 'batch', 'ok': False, 'errors': errors})
+            return future
+        self.logger.info("Running batch of {} commands for {}".format(len(batch.actions), ", ".join(batch.involved)))
+        batch.dispatch()
+        if batch.timeout is None:
+            return batch.wait_ready(self.config.get('batch_timeout', 120))
+        return batch.wait_ready(batch.timeout)
 
     @log_exceptions
     def new_xbee_node(self, node, *args, **kwargs):
@@ -167,18 +552,32 @@ class KaraCRTL(ConfigMixin, ZMQMixin, TimersMixin):
             return
         strid = node.node_identifier.decode('ascii')
         if strid in self.motors:
-            del self.motors[strid]
+            self.motors[strid].attach_node(node)
+            self.logger.info("Re-attached motor {}".format(node.node_identifier))
+            return
         self.motors[strid] = KaraMoottori(node, self.config['motors'], logger_name=self.logger_name)
         self.logger.info("Added motor {}".format(node.node_identifier))
 
+    @log_exceptions
+    def expired_xbee_node(self, node, *args, **kwargs):
+        """Cached node that never showed up, drop the motor built on it until discovery finds the real one"""
+        strid = node.node_identifier.decode('ascii')
+        if strid in self.motors and self.motors[strid].node is node:
+            self.logger.warning("Removed motor {}, it was only in the node cache".format(strid))
+            del self.motors[strid]
+
     @log_exceptions
     def cleanup(self, *args, **kwargs):
         """Cleanup SHOULD be called before quitting mainloop.
         remember to use super() to call all mixin/parent cleanup methods too"""
+        if self.sequencer:
+            self.sequencer.stop()
+        self.cancel_radio_retries()
         for mkey in self.motors.keys():
             self.motors[mkey].stop()
         if self.xbeehandler:
             self.xbeehandler.quit()
+        self.close_telemetry()
         super().cleanup(*args, **kwargs)
 
     @log_exceptions
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""Radio I/O process, owns the serial port and the XBee and relays frames to/from karactrl.py over ZMQ.
+
+Run with the same configuration file as karactrl.py (radio.mode set to "process"), the "karactrl" root key is
+used if there is one"""
+import serial
+from xbee import ZigBee
+
+from core import main
+from core.decorators import log_exceptions
+from core.mixins import ConfigMixin, TimersMixin, ZMQMixin
+from xbeehandlers.remote import AT_TOPIC, RX_TOPIC, TX_TOPIC, pack_frame, unpack_frame
+
+
+class RadioCTRL(ConfigMixin, ZMQMixin, TimersMixin):
+    serialport = None
+    xb = None
+    retry_handle = None
+
+    def __init__(self, *args, **kwargs):
+        self.mainloop = kwargs.pop('mainloop')
+        if not self.mainloop:
+            raise RuntimeError('"mainloop" must be provided to __init__')
+        super().__init__(*args, **kwargs)
+        self.reload()
+
+    def hook_signals(self):
+        """Hooks POSIX signals to correct callbacks, call only from the main thread!"""
+        import signal as posixsignal
+        posixsignal.signal(posixsignal.SIGTERM, self.quit)
+        try:
+            posixsignal.signal(posixsignal.SIGQUIT, self.quit)
+            posixsignal.signal(posixsignal.SIGHUP, self.reload)
+        except AttributeError:
+            pass
+
+    @log_exceptions
+    def reload(self, *args, **kwargs):
+        super().reload(*args, **kwargs)
+        self.close_radio()
+        self.subscribe(self.config['radio']['tx_socket'], TX_TOPIC, self.command_rx)
+        self.subscribe(self.config['radio']['tx_socket'], AT_TOPIC, self.command_rx)
+        self.connect_radio()
+
+    @log_exceptions
+    def connect_radio(self):
+        """Open the serial port, retrying every radio_retry.max seconds if it's not there"""
+        self.retry_handle = None
+        serial_config = dict(self.config['serial'])
+        serial_config.pop('disable', None)
+        try:
+            self.serialport = serial.Serial(**serial_config)
+        except (serial.SerialException, OSError) as e:
+            self.logger.error("Could not open serial port: {}".format(e))
+            self.retry_handle = self.mainloop.call_later(
+                self.config.get('radio_retry', {}).get('max', 30.0),
+                self.connect_radio
+            )
+            return
+        self.xb = ZigBee(
+            self.serialport,
+            callback=self.xbee_callback,
+            error_callback=self.error_callback,
+            escaped=False
+        )
+        self.logger.info("Radio up on {}".format(serial_config['port']))
+
+    @log_exceptions
+    def close_radio(self):
+        if self.retry_handle:
+            self.mainloop.remove_timeout(self.retry_handle)
+            self.retry_handle = None
+        if self.xb:
+            self.xb.halt()
+            self.xb = None
+        if self.serialport:
+            self.serialport.close()
+            self.serialport = None
+
+    def xbee_callback(self, packet):
+        """Called in the XBee thread, hand over to the IOLoop for sending"""
+        self.mainloop.add_callback(self.forward_packet, packet)
+
+    @log_exceptions
+    def forward_packet(self, packet):
+        self.publish(self.config['radio']['rx_socket'], RX_TOPIC, pack_frame(packet))
+
+    @log_exceptions
+    def error_callback(self, *args):
+        self.logger.error("Got error args: {}".format(args))
+
+    @log_exceptions
+    def command_rx(self, frames):
+        """tx/at command from the main process"""
+        topic, payload = frames
+        if not self.xb:
+            self.logger.warning("Radio is not up, dropping {} command".format(topic))
+            return
+        kwargs = unpack_frame(payload)
+        if topic == TX_TOPIC.encode('utf-8'):
+            self.xb.tx(**kwargs)
+        elif topic == AT_TOPIC.encode('utf-8'):
+            self.xb.at(**kwargs)
+
+    @log_exceptions
+    def cleanup(self, *args, **kwargs):
+        self.close_radio()
+        super().cleanup(*args, **kwargs)
+
+    @log_exceptions
+    def quit(self, *args):
+        """Cleans up and stops mainloop"""
+        self.logger.info("Quitting")
+        self.cleanup()
+        self.mainloop.stop()
+
+    @log_exceptions
+    def run(self):
+        """Starts the mainloop, will only return when mainloop stops"""
+        self.logger.info("Starting mainloop")
+        self.mainloop.start()
+        self.mainloop.close()
+
+
+if __name__ == '__main__':
+    instance = main(__file__, RadioCTRL, config_name='karactrl')
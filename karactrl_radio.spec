@@ -0,0 +1,27 @@
+# -*- mode: python -*-
+
+block_cipher = None
+
+a = Analysis(['karactrl_radio.py'],
+             pathex=['core', 'xbeehandlers'],
+             binaries=[],
+             datas=[],
+             hiddenimports=[],
+             hookspath=[],
+             runtime_hooks=[],
+             excludes=[],
+             win_no_prefer_redirects=False,
+             win_private_assemblies=False,
+             cipher=block_cipher)
+pyz = PYZ(a.pure, a.zipped_data,
+             cipher=block_cipher)
+exe = EXE(pyz,
+          a.scripts,
+          a.binaries,
+          a.zipfiles,
+          a.datas,
+          name='karactrl_radio',
+          debug=False,
+          strip=False,
+          upx=True,
+          console=True )
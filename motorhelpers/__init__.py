@@ -1 +1,2 @@
+from .batch import BatchCommand
 from .motor import KaraMoottori
@@ -0,0 +1,168 @@
+import math
+import time
+
+from tornado.concurrent import Future
+from tornado.ioloop import PeriodicCallback
+
+from core.decorators import log_exceptions
+from core.mixins import LoggerMixin
+
+COMMANDS = ('go_to', 'stop', 'home')
+
+
+def as_percent(value):
+    """Parse percentage the same way go_to does, raises ValueError if not a number in 0-100 range"""
+    if isinstance(value, str):
+        value = value.replace(',', '.')
+    value = float(value)
+    if not 0 <= value <= 100:
+        raise ValueError("{} is not within 0-100".format(value))
+    return value
+
+
+def transmit_moves(moves):
+    """Send list of (motor, messages) in one pass, speeds for all motors first and then all the targets so the
+    motors start moving as close to each other as the radio allows. Motors still homing are left out, returns the
+    list of moves actually sent"""
+    sent = []
+    for motor, messages in moves:
+        if motor.homing:
+            motor.logger.error("{} is still homing, not sending position command".format(motor.name))
+            continue
+        motor.ready = False
+        motor.report_moving()
+        sent.append((motor, messages))
+    for motor, messages in sent:
+        for msg in messages[:-1]:
+            motor.transmit(msg)
+    for motor, messages in sent:
+        motor.transmit(messages[-1])
+    return sent
+
+
+class BatchCommand(LoggerMixin, object):
+    """
+    Many motor commands validated together and sent in one pass, commands is list of dicts
+    [
+        {"motor": "Motor1", "cmd": "go_to", "position": 20, "speed": 50},
+        {"motor": "Motor2", "cmd": "stop"},
+        {"motor": "*", "cmd": "home"}  # "*" means every motor
+    ]
+    """
+    errors = []
+    actions = []
+
+    def __init__(self, commands, motors, *args, **kwargs):
+        self.timeout = kwargs.pop('timeout', None)  # seconds for wait_ready, None for the default
+        super().__init__(*args, **kwargs)
+        self.commands = commands
+        self.motors = motors
+        self.errors = []
+        self.actions = []
+
+    @log_exceptions
+    def validate(self):
+        """Check every command and encode the messages, returns list of all problems found"""
+        self.errors = []
+        self.actions = []
+        homed = set()  # go_to for these would be refused by the motor anyway
+        if self.timeout is not None and (isinstance(self.timeout, bool)
+                                         or not isinstance(self.timeout, (int, float))
+                                         or not 0 < self.timeout < math.inf):
+            self.errors.append("timeout must be a positive number of seconds, got {}".format(repr(self.timeout)))
+        if not isinstance(self.commands, list) or not self.commands:
+            self.errors.append("commands must be a non-empty list")
+            return self.errors
+        for idx, command in enumerate(self.commands):
+            if not isinstance(command, dict):
+                self.errors.append("#{}: command must be an object".format(idx))
+                continue
+            cmd = command.get('cmd')
+            if cmd not in COMMANDS:
+                self.errors.append("#{}: unknown cmd {}, must be one of {}".format(idx, repr(cmd), ", ".join(COMMANDS)))
+                continue
+            mkey = command.get('motor')
+            if not isinstance(mkey, str):
+                self.errors.append("#{}: motor must be a string, got {}".format(idx, repr(mkey)))
+                continue
+            if mkey == '*':
+                mkeys = list(self.motors.keys())
+            elif mkey in self.motors:
+                mkeys = [mkey]
+            else:
+                self.errors.append("#{}: motor {} is not available".format(idx, repr(mkey)))
+                continue
+            if cmd != 'go_to':
+                self.actions += [(mkey, cmd, None) for mkey in mkeys]
+                if cmd == 'home':
+                    homed.update(mkeys)
+                continue
+            try:
+                position = as_percent(command['position'])
+                speed = as_percent(command['speed']) if command.get('speed') is not None else None
+            except KeyError:
+                self.errors.append("#{}: go_to needs position".format(idx))
+                continue
+            except ValueError as e:
+                self.errors.append("#{}: {}".format(idx, e))
+                continue
+            for mkey in mkeys:
+                if self.motors[mkey].homing or mkey in homed:
+                    self.errors.append("#{}: {} is homing".format(idx, mkey))
+                    continue
+                self.actions.append((mkey, cmd, self.motors[mkey].go_to_messages(position, speed)))
+        return self.errors
+
+    @log_exceptions
+    def dispatch(self):
+        """Transmit everything, stops and homes first and then the moves (see transmit_moves)"""
+        moves = []
+        for mkey, cmd, messages in self.actions:
+            motor = self.motors[mkey]
+            if cmd == 'stop':
+                motor.stop()
+            elif cmd == 'home':
+                motor.home()
+            else:
+                moves.append((motor, messages))
+        transmit_moves(moves)
+
+    @property
+    def involved(self):
+        return sorted(set(mkey for mkey, _, _ in self.actions))
+
+    def status(self):
+        ret = {}
+        for mkey in self.involved:
+            motor = self.motors.get(mkey)
+            ret[mkey] = {
+                'ready': bool(motor and motor.ready),
+                'homing': bool(motor and motor.homing),
+                'position': motor.current_pos if motor else None,
+            }
+        return ret
+
+    def wait_ready(self, timeout, interval=100):
+        """Returns a Future that resolves to aggregated status once every involved motor is ready or the timeout
+        (seconds) expires"""
+        future = Future()
+        started = time.time()
+
+        @log_exceptions
+        def check():
+            status = self.status()
+            all_ready = all(mstatus['ready'] for mstatus in status.values())
+            if not all_ready and (time.time() - started) < timeout:
+                return
+            poller.stop()
+            if not future.done():
+                future.set_result({
+                    'type': 'batch',
+                    'ok': all_ready,
+                    'timed_out': not all_ready,
+                    'motors': status,
+                })
+
+        poller = PeriodicCallback(check, interval)
+        poller.start()
+        return future
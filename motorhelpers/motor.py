@@ -1,5 +1,6 @@
 import binascii
 import struct
+import time
 
 from core.decorators import log_exceptions
 from core.mixins import LoggerMixin
@@ -12,14 +13,27 @@ class KaraMoottori(LoggerMixin):
     homing = True
     target_pos = 0.0
     current_pos = 0.0
+    report_interval = None  # what we last asked the node for, None if unknown
+    last_command = 0
+    ready_since = 0  # time.monotonic_ns() of the status report that made us ready
+    sent_speed = None  # last F message sent, the node holds on to it until told otherwise
+    ignore_stop_report = False  # the next MS answers a stop we follow with a new target right away
 
     def __init__(self, node, config, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.config = config
+        self.attach_node(node)
+
+    def attach_node(self, node):
+        """Bind to given node, used also when the node object gets replaced (radio restart) so we keep our state"""
         self.node = node
         self.name = self.node.node_identifier
+        # New node object may well mean a rebooted node running on firmware defaults
+        self.report_interval = None
+        self.sent_speed = None
         self.logger.debug("self.node.rx_callbacks size before {}".format(len(self.node.rx_callbacks)))
-        self.node.rx_callbacks.append(self.node_rx_callback)
+        if self.node_rx_callback not in self.node.rx_callbacks:
+            self.node.rx_callbacks.append(self.node_rx_callback)
         self.logger.debug("{} rx callback is {}".format(self.name, self.node_rx_callback))
         self.logger.debug("{} node is {}".format(self.name, self.node))
         self.logger.debug("self.node.rx_callbacks size after {}".format(len(self.node.rx_callbacks)))
@@ -28,6 +42,7 @@ class KaraMoottori(LoggerMixin):
     def node_rx_callback(self, packet, node):
         """Handle messages from node, set ready-state accordingly"""
         data = packet['rf_data']
+        was_ready = self.ready
         if data[0] != ord('M'):
             self.logger.warning("{}: Got packet that did not start with 'M' don't know how to handle those".format(self.name))
             return
@@ -38,6 +53,12 @@ class KaraMoottori(LoggerMixin):
         self.target_pos = (target_steps / self.config['max_steps']) * 100
         self.current_pos = (current_steps / self.config['max_steps']) * 100
 
+        if data[:2] == b'MS' and self.ignore_stop_report:
+            # Only the position is news, we already sent the motor on its way again
+            self.ignore_stop_report = False
+            self.logger.debug("{}: Ignoring stop report at {:0.2f}%".format(self.name, self.current_pos))
+            return
+
         if target_steps == current_steps:
             self.ready = True
         else:
@@ -64,6 +85,12 @@ class KaraMoottori(LoggerMixin):
             # Make extra damn sure
             self.ready = False
 
+        if self.ready and not was_ready:
+            self.ready_since = time.monotonic_ns()
+
+        if self.ready and (time.monotonic() - self.last_command) > self.config.get('report_idle_after', 2.0):
+            self.report_idle()
+
         self.logger.debug("{}: Current position {:0.2f}% ({}), target position {:0.2f}% ({})".format(
             self.name,
             self.current_pos,
@@ -73,17 +100,42 @@ class KaraMoottori(LoggerMixin):
         ))
         self.logger.debug("{}: ready={} homing={}".format(self.name, int(self.ready), int(self.homing)))
 
+    @log_exceptions
+    def set_report_interval(self, interval_ms):
+        """Ask the node to send its timed (MT) reports every interval_ms, only sent if it changes"""
+        if interval_ms is None or interval_ms == self.report_interval:
+            return
+        msg = b"R" + self.hex_encode_uint16_t(interval_ms)
+        self.logger.debug("{}: Sending {}, report interval {}ms".format(self.name, msg, interval_ms))
+        self.node.tx_string(msg)
+        self.report_interval = interval_ms
+
+    def report_moving(self):
+        """Fast status reports, we're waiting for the move to finish"""
+        self.last_command = time.monotonic()
+        self.set_report_interval(self.config.get('report_interval_moving'))
+
+    def report_idle(self):
+        """Slow status reports, nothing is happening (stops are reported by MS right away regardless)"""
+        self.set_report_interval(self.config.get('report_interval_idle'))
+
     @log_exceptions
     def home(self):
-        """Send stop-command to node"""
+        """Send home-command to node"""
         self.ready = False
         self.homing = True
+        self.ignore_stop_report = False
+        # Homing may well use its own speed
+        self.sent_speed = None
+        self.report_moving()
         self.node.tx_string(b"H")
 
     @log_exceptions
-    def stop(self):
-        """Send stop-command to node"""
+    def stop(self, ignore_report=False):
+        """Send stop-command to node, with ignore_report the MS it answers with does not mark us ready"""
+        self.ignore_stop_report = ignore_report
         self.ready = False
+        self.last_command = time.monotonic()
         self.node.tx_string(b"S")
 
     def hex_encode_uint16_t(self, input):
@@ -94,29 +146,57 @@ class KaraMoottori(LoggerMixin):
         be = struct.pack('>i', input)
         return binascii.hexlify(be).upper()
 
-    @log_exceptions
-    def go_to(self, len_percent, speed_percent=None):
-        """Move to position (given as percentage of full travel), if travel speed is not defined previous value held
-        in the controller memory will be used"""
-        if self.homing:
-            self.logger.error("{} is still homing, not sending position command", self.name)
-            return False
-        self.ready = False
+    def go_to_messages(self, len_percent, speed_percent=None):
+        """Encode the speed (if given) and position commands for a move, returns list of messages to send"""
         if isinstance(len_percent, str):
-            len_percent = len_percent.replace(',','.')
+            len_percent = len_percent.replace(',', '.')
         if isinstance(speed_percent, str):
-            speed_percent = speed_percent.replace(',','.')
+            speed_percent = speed_percent.replace(',', '.')
         len_percent = float(len_percent)
-        speed_percent = float(speed_percent)
-        if speed_percent:
+        ret = []
+        if speed_percent is not None and float(speed_percent):
+            speed_percent = float(speed_percent)
             pps = int((self.config['max_speed'] / 100) * speed_percent)
             # sanity check
             if pps < 1:
                 pps = 15
             msg = b"F" + self.hex_encode_uint16_t(pps)
-            self.logger.debug("{}: Sending {}, pps={} ({:0.2f}%)".format(self.name, msg, pps, speed_percent))
-            self.node.tx_string(msg)
+            self.logger.debug("{}: Encoded {}, pps={} ({:0.2f}%)".format(self.name, msg, pps, speed_percent))
+            ret.append(msg)
         target_pos = int((self.config['max_steps'] / 100) * len_percent)
         msg = b"G" + self.hex_encode_int32_t(target_pos)
-        self.logger.debug("{}: Sending {}, target_pos={} ({:0.2f}%)".format(self.name, msg, target_pos, len_percent))
+        self.logger.debug("{}: Encoded {}, target_pos={} ({:0.2f}%)".format(self.name, msg, target_pos, len_percent))
+        ret.append(msg)
+        return ret
+
+    def setpoint_messages(self, len_percent, speed_percent=None):
+        """Like go_to_messages but leaves out the speed if the node already has it"""
+        return [msg for msg in self.go_to_messages(len_percent, speed_percent) if msg != self.sent_speed]
+
+    def transmit(self, msg):
+        """Send single pre-encoded message, keeping track of the speed the node has"""
+        self.logger.debug("{}: Sending {}".format(self.name, msg))
+        if msg[:1] == b"F":
+            self.sent_speed = msg
         self.node.tx_string(msg)
+
+    @log_exceptions
+    def send_messages(self, messages):
+        """Send pre-encoded position commands (see go_to_messages)"""
+        if self.homing:
+            self.logger.error("{} is still homing, not sending position command".format(self.name))
+            return False
+        self.ready = False
+        self.report_moving()
+        for msg in messages:
+            self.transmit(msg)
+        return True
+
+    @log_exceptions
+    def go_to(self, len_percent, speed_percent=None):
+        """Move to position (given as percentage of full travel), if travel speed is not defined previous value held
+        in the controller memory will be used"""
+        if self.homing:
+            self.logger.error("{} is still homing, not sending position command".format(self.name))
+            return False
+        return self.send_messages(self.go_to_messages(len_percent, speed_percent))
@@ -0,0 +1,166 @@
+"""Trapezoidal and S-curve motion profiles for coordinated multi-motor moves.
+
+All positions are in percent of full travel and all times in seconds, same units as used in the sequence files.
+"""
+import math
+
+# Ramp time multiplier for given peak acceleration, cosine (S-curve) ramp needs pi/2 times longer ramp than
+# linear one to stay within the same peak acceleration, distance covered during the ramp is vc*ta/2 for both
+SHAPE_RAMP_FACTOR = {
+    'trapezoid': 1.0,
+    'scurve': math.pi / 2,
+}
+
+
+def as_float(value):
+    """Sequence files may have decimal commas in strings"""
+    if isinstance(value, str):
+        value = value.replace(',', '.')
+    return float(value)
+
+
+class MotionProfile(object):
+    """Single axis move from start to end, ramping to cruise velocity in ramp_time and completing in duration"""
+    start = 0.0
+    end = 0.0
+    duration = 0.0
+    ramp_time = 0.0
+    cruise_velocity = 0.0
+    shape = 'trapezoid'
+
+    def __init__(self, start, end, duration, cruise_velocity, ramp_time, shape='trapezoid'):
+        self.start = start
+        self.end = end
+        self.duration = duration
+        self.cruise_velocity = cruise_velocity
+        self.ramp_time = ramp_time
+        self.shape = shape
+        self.direction = 1.0 if end >= start else -1.0
+
+    def _ramp_distance(self, t):
+        """Distance covered t seconds into the acceleration ramp"""
+        vc, ta = self.cruise_velocity, self.ramp_time
+        if ta <= 0:
+            return 0.0
+        if self.shape == 'scurve':
+            return (vc / 2) * (t - (ta / math.pi) * math.sin(math.pi * t / ta))
+        return 0.5 * (vc / ta) * t * t
+
+    def _ramp_velocity(self, t):
+        """Velocity t seconds into the acceleration ramp"""
+        vc, ta = self.cruise_velocity, self.ramp_time
+        if ta <= 0:
+            return vc
+        if self.shape == 'scurve':
+            return (vc / 2) * (1 - math.cos(math.pi * t / ta))
+        return vc * t / ta
+
+    def position(self, t):
+        """Position (percent) at t seconds since start of move"""
+        if t <= 0:
+            return self.start
+        if t >= self.duration:
+            return self.end
+        distance = abs(self.end - self.start)
+        if t < self.ramp_time:
+            travelled = self._ramp_distance(t)
+        elif t <= self.duration - self.ramp_time:
+            travelled = self._ramp_distance(self.ramp_time) + self.cruise_velocity * (t - self.ramp_time)
+        else:
+            travelled = distance - self._ramp_distance(self.duration - t)
+        return self.start + self.direction * travelled
+
+    def velocity(self, t):
+        """Absolute velocity (percent/s) at t seconds since start of move"""
+        if t <= 0 or t >= self.duration:
+            return 0.0
+        if t < self.ramp_time:
+            return self._ramp_velocity(t)
+        if t <= self.duration - self.ramp_time:
+            return self.cruise_velocity
+        return self._ramp_velocity(self.duration - t)
+
+
+class StepPlan(object):
+    """Synchronized profiles for all motors in a single sequence step"""
+    duration = 0.0
+    profiles = {}
+
+    def __init__(self, duration, profiles):
+        self.duration = duration
+        self.profiles = profiles
+
+    def start_positions(self):
+        return {mkey: profile.start for mkey, profile in self.profiles.items()}
+
+
+def velocity_limit(speed_percent, motors_config):
+    """Convert sequence speed percentage to percent of travel per second"""
+    pps = (motors_config['max_speed'] / 100) * speed_percent
+    return max(pps, 1.0) / motors_config['max_steps'] * 100
+
+
+def speed_percent(velocity, motors_config):
+    """Convert percent of travel per second back to the speed percentage used by KaraMoottori.go_to"""
+    return (velocity / 100 * motors_config['max_steps']) / motors_config['max_speed'] * 100
+
+
+def accel_limit(trajectory_config, motors_config):
+    """Convert configured acceleration (steps/s^2) to percent of travel per second squared"""
+    return trajectory_config['max_accel'] / motors_config['max_steps'] * 100
+
+
+def minimum_time(distance, vmax, accel, k):
+    """Fastest time to cover distance within velocity and acceleration limits, k is the shape ramp factor"""
+    if distance <= 0:
+        return 0.0
+    if distance >= k * vmax * vmax / accel:
+        return distance / vmax + k * vmax / accel
+    # Never reaches vmax, triangular profile
+    return 2 * math.sqrt(k * distance / accel)
+
+
+def synchronized_profile(start, end, duration, accel, shape):
+    """Profile that covers start->end in exactly duration, with cruise velocity lowered as needed"""
+    k = SHAPE_RAMP_FACTOR[shape]
+    distance = abs(end - start)
+    if distance <= 0 or duration <= 0:
+        return MotionProfile(start, end, duration, 0.0, 0.0, shape)
+    # Solve distance = vc * (duration - k*vc/accel) for the smaller root (ramps must fit in the move)
+    discriminant = max(duration * duration - 4 * k * distance / accel, 0.0)
+    vc = (duration - math.sqrt(discriminant)) / (2 * k / accel)
+    return MotionProfile(start, end, duration, vc, k * vc / accel, shape)
+
+
+def plan_step(targets, start_positions, motors_config, trajectory_config):
+    """Plan a single step so that all motors arrive simultaneously.
+
+    targets is dict of motorkey -> (position, speed) as in SequenceStep, start_positions dict of motorkey -> position"""
+    shape = trajectory_config.get('shape', 'trapezoid')
+    k = SHAPE_RAMP_FACTOR[shape]
+    accel = accel_limit(trajectory_config, motors_config)
+    duration = 0.0
+    for mkey, (pos, speed) in targets.items():
+        distance = abs(pos - start_positions.get(mkey, pos))
+        duration = max(duration, minimum_time(distance, velocity_limit(speed, motors_config), accel, k))
+    profiles = {}
+    for mkey, (pos, _) in targets.items():
+        profiles[mkey] = synchronized_profile(start_positions.get(mkey, pos), pos, duration, accel, shape)
+    return StepPlan(duration, profiles)
+
+
+def plan_sequence(steps, motors_config, trajectory_config, start_positions=None):
+    """Plan all steps of a sequence in one pass, returns list of StepPlans (or None where start is unknown).
+
+    Each step starts from where the previous step left the motors, start_positions gives the positions before
+    the first step, motors missing from it get their first step planned at runtime instead."""
+    positions = dict(start_positions or {})
+    plans = []
+    for step in steps:
+        targets = {mkey: (as_float(pos), as_float(speed)) for mkey, (pos, speed) in step['motors'].items()}
+        if all(mkey in positions for mkey in targets):
+            plans.append(plan_step(targets, positions, motors_config, trajectory_config))
+        else:
+            plans.append(None)
+        positions.update({mkey: pos for mkey, (pos, _) in targets.items()})
+    return plans
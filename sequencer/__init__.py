@@ -1 +1,3 @@
+from .compiler import SequenceCompiler, validate_sequence
+from .runner import SequenceRunner, sequence_groups
 from .sequence import Sequence
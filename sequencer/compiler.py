@@ -0,0 +1,162 @@
+import copy
+import hashlib
+import json
+
+from core.decorators import log_exceptions
+from core.mixins import LoggerMixin
+from motorhelpers.trajectory import as_float
+
+from .runner import sequence_groups
+from .sequence import plan_trajectories
+
+
+def _check_percent(value, what, errors):
+    """Append error if value is not a number within 0-100"""
+    try:
+        value = as_float(value)
+    except (TypeError, ValueError):
+        errors.append("{} is not a number: {}".format(what, repr(value)))
+        return
+    if not 0 <= value <= 100:
+        errors.append("{} must be within 0-100, got {}".format(what, value))
+
+
+def validate_sequence(sequenceconfig, known_motors=None):
+    """Check the whole sequence configuration, returns list of every problem found (empty if all good). Motor
+    names are checked against known_motors unless it is None"""
+    errors = []
+    if not isinstance(sequenceconfig, dict):
+        return ["sequence must be an object"]
+    if 'groups' in sequenceconfig and not isinstance(sequenceconfig['groups'], dict):
+        return ["groups must be an object"]
+    grouped = 'groups' in sequenceconfig
+    owners = {}  # mkey -> group that drives it
+    for name, groupconfig in sequence_groups(sequenceconfig).items():
+        prefix = "{}: ".format(name) if grouped else ""
+        if not isinstance(groupconfig, dict):
+            errors.append("{}sequence must be an object".format(prefix))
+            continue
+        for key in ('loop', 'start_with_home', 'steps'):
+            if key not in groupconfig:
+                errors.append("{}missing '{}'".format(prefix, key))
+        group_motors = groupconfig.get('motors')
+        if grouped and not isinstance(group_motors, list):
+            # Group without motors would drive (and home) every motor, including the other groups' ones
+            errors.append("{}missing 'motors' list".format(prefix))
+            group_motors = None
+        if group_motors is not None:
+            for mkey in group_motors:
+                if known_motors is not None and mkey not in known_motors:
+                    errors.append("{}unknown motor '{}' in group".format(prefix, mkey))
+                if mkey in owners:
+                    errors.append("{}motor '{}' is already in group {}".format(prefix, mkey, owners[mkey]))
+                    continue
+                owners[mkey] = name
+        steps = groupconfig.get('steps', [])
+        if not isinstance(steps, list):
+            errors.append("{}steps must be a list".format(prefix))
+            continue
+        if not steps and groupconfig.get('loop'):
+            errors.append("{}looping sequence needs at least one step".format(prefix))
+        for idx, step in enumerate(steps):
+            where = "{}step {}".format(prefix, idx + 1)
+            if not isinstance(step, dict):
+                errors.append("{} must be an object".format(where))
+                continue
+            if 'dwell' not in step:
+                errors.append("{}: missing 'dwell'".format(where))
+            else:
+                try:
+                    if as_float(step['dwell']) < 0:
+                        errors.append("{}: dwell must not be negative".format(where))
+                except (TypeError, ValueError):
+                    errors.append("{}: dwell is not a number: {}".format(where, repr(step['dwell'])))
+            if 'barrier' in step and not isinstance(step['barrier'], str):
+                errors.append("{}: barrier must be a string".format(where))
+            if not isinstance(step.get('motors'), dict):
+                errors.append("{}: missing 'motors'".format(where))
+                continue
+            for mkey, target in step['motors'].items():
+                if known_motors is not None and mkey not in known_motors:
+                    errors.append("{}: unknown motor '{}'".format(where, mkey))
+                elif group_motors is not None and mkey not in group_motors:
+                    errors.append("{}: motor '{}' is not in the group".format(where, mkey))
+                if not isinstance(target, list) or len(target) != 2:
+                    errors.append("{}: {} must be [position, speed]".format(where, mkey))
+                    continue
+                _check_percent(target[0], "{}: {} position".format(where, mkey), errors)
+                _check_percent(target[1], "{}: {} speed".format(where, mkey), errors)
+    return errors
+
+
+def normalize_sequence(sequenceconfig):
+    """Copy of a validated sequence with all the numbers parsed, so nothing is parsed at runtime"""
+    ret = copy.deepcopy(sequenceconfig)
+    for groupconfig in sequence_groups(ret).values():
+        for step in groupconfig['steps']:
+            step['dwell'] = as_float(step['dwell'])
+            for mkey, target in step['motors'].items():
+                step['motors'][mkey] = [as_float(target[0]), as_float(target[1])]
+    return ret
+
+
+class CompiledSequence(object):
+    """Validated and normalized sequence with precomputed trajectory plans (per group)"""
+    config = {}
+    plans = {}
+    errors = []
+
+    def __init__(self, config, plans, errors):
+        self.config = config
+        self.plans = plans
+        self.errors = errors
+
+
+class SequenceCompiler(LoggerMixin, object):
+    """Validates and compiles sequence files, caching the results by content hash"""
+    cache = {}
+
+    def __init__(self, *args, **kwargs):
+        self.max_entries = kwargs.pop('max_entries', 8)
+        super().__init__(*args, **kwargs)
+        self.cache = {}
+
+    def cache_key(self, raw, known_motors, motors_config, trajectory_config):
+        """Content hash of the file and every setting the result depends on"""
+        h = hashlib.sha256(raw)
+        motors = sorted(known_motors) if known_motors is not None else None
+        h.update(json.dumps([motors, motors_config, trajectory_config], sort_keys=True).encode('utf-8'))
+        return h.hexdigest()
+
+    @log_exceptions
+    def compile(self, sequenceconfig, known_motors, motors_config, trajectory_config):
+        """Validate and compile a sequence configuration (no caching)"""
+        errors = validate_sequence(sequenceconfig, known_motors)
+        if errors:
+            return CompiledSequence(None, {}, errors)
+        config = normalize_sequence(sequenceconfig)
+        plans = {}
+        if trajectory_config and trajectory_config.get('enabled'):
+            for name, groupconfig in sequence_groups(config).items():
+                plans[name] = plan_trajectories(groupconfig, motors_config, trajectory_config)
+        return CompiledSequence(config, plans, [])
+
+    @log_exceptions
+    def load(self, path, known_motors, motors_config, trajectory_config):
+        """Compile sequence file, unchanged files are served from the cache"""
+        with open(path, 'rb') as fp:
+            raw = fp.read()
+        key = self.cache_key(raw, known_motors, motors_config, trajectory_config)
+        if key in self.cache:
+            self.logger.debug("Sequence {} unchanged, using cached compile".format(path))
+            return self.cache[key]
+        try:
+            sequenceconfig = json.loads(raw.decode('utf-8'))
+        except ValueError as e:
+            return CompiledSequence(None, {}, ["{} is not valid JSON: {}".format(path, e)])
+        compiled = self.compile(sequenceconfig, known_motors, motors_config, trajectory_config)
+        if not compiled.errors:
+            if len(self.cache) >= self.max_entries:
+                self.cache.pop(next(iter(self.cache)))
+            self.cache[key] = compiled
+        return compiled
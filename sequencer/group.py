@@ -0,0 +1,61 @@
+import collections.abc
+
+
+class MotorGroup(collections.abc.Mapping):
+    """Live view to the controllers motors dict limited to given motor keys, motors discovered later show up
+    automatically just like in the full dict"""
+
+    def __init__(self, motors, keys):
+        self.all_motors = motors
+        self.keys_in_group = tuple(keys)
+
+    def __getitem__(self, mkey):
+        if mkey not in self.keys_in_group:
+            raise KeyError(mkey)
+        return self.all_motors[mkey]
+
+    def __iter__(self):
+        return (mkey for mkey in self.keys_in_group if mkey in self.all_motors)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __contains__(self, mkey):
+        return mkey in self.keys_in_group and mkey in self.all_motors
+
+
+class SyncBarrier(object):
+    """Named meeting point for sequences running in parallel, none of the parties proceeds past it until all
+    of them have arrived. Reusable so looping sequences meet again on every round."""
+    name = None
+    parties = ()
+    arrived = set()
+    generation = 0
+
+    def __init__(self, name, parties):
+        self.name = name
+        self.parties = frozenset(parties)
+        self.arrived = set()
+        self.generation = 0
+
+    def arrive(self, party):
+        """Mark party as waiting, returns the generation to pass to passed()"""
+        self.arrived.add(party)
+        generation = self.generation
+        self._open_if_complete()
+        return generation
+
+    def leave(self, party):
+        """Party has finished or was stopped, the others no longer wait for it"""
+        self.parties = self.parties - {party}
+        self.arrived.discard(party)
+        self._open_if_complete()
+
+    def _open_if_complete(self):
+        if self.arrived and self.arrived >= self.parties:
+            self.arrived = set()
+            self.generation += 1
+
+    def passed(self, generation):
+        """Has the barrier opened since given generation"""
+        return self.generation > generation
@@ -0,0 +1,99 @@
+from core.decorators import log_exceptions
+from core.mixins import LoggerMixin
+
+from .group import MotorGroup, SyncBarrier
+from .sequence import Sequence
+
+
+def sequence_groups(sequenceconfig):
+    """Dict of group name -> Sequence configuration, plain single sequence files are one group"""
+    if 'groups' in sequenceconfig:
+        return sequenceconfig['groups']
+    return {Sequence.name: sequenceconfig}
+
+
+class SequenceRunner(LoggerMixin, object):
+    """
+    Runs independent sequences for groups of motors side by side, sequenceconfig is either a single Sequence
+    configuration (which then drives all motors) or dict
+    {
+        "groups": {
+            "front": {
+                "motors": ["Motor1", "Motor2"],
+                "loop": True,
+                "start_with_home": False,
+                "steps": [ ... ]  # SequenceStep configurations, "barrier": "name" holds the step until all groups
+                                  # having the same barrier have reached it
+            },
+            ...
+        }
+    }
+    """
+    sequences = {}
+    barriers = {}
+
+    def __init__(self, sequenceconfig, motors, *args, **kwargs):
+        self.motors_config = kwargs.pop('motors_config', None)
+        self.trajectory_config = kwargs.pop('trajectory_config', None)
+        plans = kwargs.pop('plans', {})
+        self.lookahead = kwargs.pop('lookahead', Sequence.lookahead)
+        self.wakeup = kwargs.pop('wakeup', None)
+        self.faults_config = kwargs.pop('faults_config', None)
+        super().__init__(*args, **kwargs)
+        self.config = sequenceconfig
+        self.motors = motors
+        self.sequences = {}
+        groups = sequence_groups(self.config)
+        self.barriers = self._make_barriers(groups)
+        for name, groupconfig in groups.items():
+            if 'motors' in groupconfig:
+                group_motors = MotorGroup(self.motors, groupconfig['motors'])
+            else:
+                group_motors = self.motors
+            self.sequences[name] = Sequence(
+                groupconfig,
+                group_motors,
+                name=name,
+                barriers=self.barriers,
+                motors_config=self.motors_config,
+                trajectory_config=self.trajectory_config,
+                plans=plans.get(name),
+                lookahead=self.lookahead,
+                wakeup=self.wakeup,
+                faults_config=self.faults_config,
+                logger_name=self.logger_name
+            )
+
+    def _make_barriers(self, groups):
+        """Barrier parties are all the groups that have a step with the barrier name"""
+        parties = {}
+        for name, groupconfig in groups.items():
+            for step in groupconfig['steps']:
+                if step.get('barrier'):
+                    parties.setdefault(step['barrier'], set()).add(name)
+        return {barrier_name: SyncBarrier(barrier_name, names) for barrier_name, names in parties.items()}
+
+    @property
+    def done(self):
+        return all(sequence.done for sequence in self.sequences.values())
+
+    @log_exceptions
+    def iterate(self):
+        """Iterate each running sequence, one group waiting for its motors does not hold the others"""
+        for sequence in self.sequences.values():
+            if sequence.done:
+                continue
+            sequence.iterate()
+
+    def stats(self):
+        """Planned vs achieved step timing and degraded motors per group"""
+        ret = {}
+        for name, sequence in self.sequences.items():
+            ret[name] = sequence.timing.as_dict()
+            ret[name]['degraded'] = sorted(sequence.degraded)
+        return ret
+
+    @log_exceptions
+    def stop(self):
+        for sequence in self.sequences.values():
+            sequence.stop()
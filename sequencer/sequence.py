@@ -1,7 +1,23 @@
+import collections
+
 from core.decorators import log_exceptions
 from core.mixins import LoggerMixin
+from motorhelpers.trajectory import plan_sequence
 
 from .step import SequenceStep
+from .timing import NS_PER_S, StepTimingStats, now_ns
+
+
+def plan_trajectories(sequenceconfig, motors_config, trajectory_config):
+    """Precompute the motion profiles for every step in one go so that stepping is just streaming"""
+    steps = sequenceconfig['steps']
+    start_positions = None
+    if sequenceconfig['start_with_home']:
+        start_positions = {mkey: 0.0 for step in steps for mkey in step['motors'].keys()}
+    elif sequenceconfig['loop'] and steps:
+        # Looping sequence starts where the last step leaves off, except on the very first round
+        start_positions = {mkey: target[0] for step in steps for mkey, target in step['motors'].items()}
+    return plan_sequence(steps, motors_config, trajectory_config, start_positions)
 
 
 class Sequence(LoggerMixin, object):
@@ -17,17 +33,61 @@ class Sequence(LoggerMixin, object):
     current_step_obj = None
     done = False
     homing_called = False
+    plans = []
+    name = 'default'
+    barriers = {}
+    barrier_generation = None
+    lookahead = 2
+    pipeline = collections.deque()
 
     def __init__(self, sequenceconfig, motors, *args, **kwargs):
+        self.name = kwargs.pop('name', self.name)
+        self.lookahead = kwargs.pop('lookahead', self.lookahead)
+        self.wakeup = kwargs.pop('wakeup', None)
+        self.faults_config = kwargs.pop('faults_config', None) or {}
+        self.degraded = set()  # motors that failed, the show goes on without waiting for them
+        self.waiting_since = None
+        self.waiting_positions = {}
+        self.timing = StepTimingStats()
+        self.previous_step_obj = None
+        self.pipeline = collections.deque()  # (step_no, prepared SequenceStep) for the steps following current
+        self.barriers = kwargs.pop('barriers', {})
+        self.motors_config = kwargs.pop('motors_config', None)
+        self.trajectory_config = kwargs.pop('trajectory_config', None)
+        plans = kwargs.pop('plans', None)
         super().__init__(*args, **kwargs)
-        self.logger.debug("initializing sequencer")
+        self.logger.debug("initializing sequencer {}".format(self.name))
         self.config = sequenceconfig
         self.motors = motors
+        self.plans = [None] * len(self.config['steps'])
+        if plans:
+            self.plans = plans
+        elif self.trajectory_config and self.trajectory_config.get('enabled'):
+            self.plans = plan_trajectories(self.config, self.motors_config, self.trajectory_config)
+            self.logger.debug("Planned {} steps, total move time {:0.2f}s".format(
+                len(self.plans),
+                sum(plan.duration for plan in self.plans if plan)
+            ))
+
+    @log_exceptions
+    def stop(self):
+        """Stop any activity of the current step"""
+        self.done = True
+        if self.current_step_obj:
+            self.current_step_obj.cancel()
+        self.leave_barriers()
+
+    def leave_barriers(self):
+        """We're not going to arrive at any barrier anymore, don't keep the other groups waiting"""
+        for barrier in self.barriers.values():
+            barrier.leave(self.name)
 
     @log_exceptions
     def motors_ready(self):
         ret = True
         for mkey in self.motors.keys():
+            if mkey in self.degraded:
+                continue
             if not self.motors[mkey].ready:
                 self.logger.debug("{} is NOT ready".format(mkey))
                 ret = False
@@ -35,6 +95,22 @@ class Sequence(LoggerMixin, object):
                 self.logger.debug("{} is READY".format(mkey))
         return ret
 
+    @log_exceptions
+    def _barrier_passed(self, step_no):
+        """Check the sync barrier (if any) in front of given step"""
+        barrier_name = self.config['steps'][step_no].get('barrier')
+        if not barrier_name or barrier_name not in self.barriers:
+            return True
+        barrier = self.barriers[barrier_name]
+        if self.barrier_generation is None:
+            self.logger.debug("{} arrived at barrier '{}'".format(self.name, barrier_name))
+            self.barrier_generation = barrier.arrive(self.name)
+        if not barrier.passed(self.barrier_generation):
+            self.logger.debug("{} waiting at barrier '{}'".format(self.name, barrier_name))
+            return False
+        self.barrier_generation = None
+        return True
+
     @log_exceptions
     def iterate(self):
         """Runs a step if previous one is ready"""
@@ -49,21 +125,93 @@ class Sequence(LoggerMixin, object):
             # Still homing ot otherwise not ready.
             if not self.motors_ready():
                 self.logger.debug("Waiting for motors before starting sequence")
-                return False
+                self.fill_pipeline()
+                if not self._start_timed_out():
+                    return False
         if self.current_step_obj and not self.current_step_obj.done():
+            if self.current_step_obj.aborted:
+                self.logger.error("Sequence {} aborted on step {}".format(self.name, self.current_step_no + 1))
+                self.stop()
+                for mkey in self.motors.keys():
+                    self.motors[mkey].stop()
+                return False
             self.logger.debug("Waiting for step to complete")
+            self.fill_pipeline()
             return False
-        self.current_step_no += 1
+        if self.current_step_obj and self.current_step_obj is not self.previous_step_obj:
+            self.timing.record_step(self.current_step_obj, self.previous_step_obj)
+            self.previous_step_obj = self.current_step_obj
+        next_step_no = self.current_step_no + 1
         if self.config['loop']:
-            self.current_step_no = self.current_step_no % len(self.config['steps'])
+            next_step_no = next_step_no % len(self.config['steps'])
         else:
-            if self.current_step_no >= len(self.config['steps']):
+            if next_step_no >= len(self.config['steps']):
                 self.done = True
+                self.leave_barriers()
+                for mkey in self.motors.keys():
+                    self.motors[mkey].report_idle()
                 return False
-        self.current_step_obj = SequenceStep(
-            self.config['steps'][self.current_step_no],
+        if not self._barrier_passed(next_step_no):
+            return False
+        self.current_step_no = next_step_no
+        if self.pipeline and self.pipeline[0][0] == self.current_step_no:
+            _, self.current_step_obj = self.pipeline.popleft()
+        else:
+            self.pipeline.clear()
+            self.current_step_obj = self._make_step(self.current_step_no)
+        self.current_step_obj.start()
+        # Prepare the following steps now that the commands are out
+        self.fill_pipeline()
+        return True
+
+    def _start_timed_out(self):
+        """Give up waiting for motors that have not moved in motor_timeout without getting ready (homed), they're
+        marked degraded"""
+        timeout = self.faults_config.get('motor_timeout')
+        if not timeout:
+            return False
+        not_ready = [mkey for mkey in self.motors.keys() if not self.motors[mkey].ready and mkey not in self.degraded]
+        positions = {mkey: self.motors[mkey].current_pos for mkey in not_ready}
+        if self.waiting_since is None or positions != self.waiting_positions:
+            # Homing a long way takes a while, only give up on motors that are not getting anywhere
+            self.waiting_since = now_ns()
+            self.waiting_positions = positions
+        if now_ns() - self.waiting_since < timeout * NS_PER_S:
+            return False
+        self.logger.error("{} not ready after {}s, starting without them".format(", ".join(not_ready), timeout))
+        self.degraded.update(not_ready)
+        return True
+
+    def _upcoming_step_no(self, offset):
+        """Number of the step offset steps after the current one, None if past end of non-looping sequence"""
+        step_no = self.current_step_no + offset
+        if self.config['loop']:
+            return step_no % len(self.config['steps'])
+        if step_no >= len(self.config['steps']):
+            return None
+        return step_no
+
+    def _make_step(self, step_no):
+        step = SequenceStep(
+            self.config['steps'][step_no],
             self.motors,
+            plan=self.plans[step_no],
+            trajectory_config=self.trajectory_config,
+            motors_config=self.motors_config,
+            wakeup=self.wakeup,
+            faults_config=self.faults_config,
+            degraded=self.degraded,
             logger_name=self.logger_name
         )
-        self.current_step_obj.start()
-        return True
+        step.prepare()
+        return step
+
+    @log_exceptions
+    def fill_pipeline(self):
+        """Build and prepare the next lookahead steps while the current one is moving or dwelling, so that moving
+        to the next step costs only the sending"""
+        while len(self.pipeline) < self.lookahead:
+            step_no = self._upcoming_step_no(len(self.pipeline) + 1)
+            if step_no is None:
+                return
+            self.pipeline.append((step_no, self._make_step(step_no)))
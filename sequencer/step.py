@@ -1,7 +1,11 @@
-import time
+from tornado.ioloop import IOLoop, PeriodicCallback
 
 from core.decorators import log_exceptions
 from core.mixins import LoggerMixin
+from motorhelpers.batch import transmit_moves
+from motorhelpers.trajectory import plan_step, speed_percent, velocity_limit
+
+from .timing import NS_PER_S, now_ns, ns_to_s
 
 
 class SequenceStep(LoggerMixin):
@@ -14,10 +18,29 @@ class SequenceStep(LoggerMixin):
         "dwell": 1.5 # seconds
     }
     """
+    # Monotonic nanosecond timestamps, see timing.now_ns
     started = None
-    dwell_started = None
+    moved = None  # when the last motor reported ready, dwell counts from here
+    dwell_deadline = None
+    finished = None
+    deadline_handle = None
+    plan = None
+    streamer = None
+    streaming = False
+    stream_offset = 0
+    resolved = {}
+    payloads = {}
+    aborted = False
+    step_deadline = None
 
     def __init__(self, stepconfig, motors, *args, **kwargs):
+        self.plan = kwargs.pop('plan', None)
+        self.trajectory_config = kwargs.pop('trajectory_config', None)
+        self.motors_config = kwargs.pop('motors_config', None)
+        self.wakeup = kwargs.pop('wakeup', None)
+        self.faults_config = kwargs.pop('faults_config', None) or {}
+        # Motors that have failed in earlier steps, shared with the Sequence, we don't wait for these
+        self.degraded = kwargs.pop('degraded', set())
         super().__init__(*args, **kwargs)
         self.config = stepconfig
         if isinstance(self.config['dwell'], str):
@@ -30,29 +53,152 @@ class SequenceStep(LoggerMixin):
                     self.config['motors'][mkey][idx] = self.config['motors'][mkey][idx].replace(',','.')
             self.config['motors'][mkey][0] = float(self.config['motors'][mkey][0])
             self.config['motors'][mkey][1] = float(self.config['motors'][mkey][1])
+        self.resolved = {}
+        self.payloads = {}
+        self.warned_missing = set()
+        self.skipped = set()
+        self.fault_deadlines = {}  # mkey -> now_ns() deadline for the motor to become ready
+        self.fault_positions = {}  # mkey -> current_pos when last checked, moving motors get more time
+        self.fault_actions = {}  # mkey -> how many policy actions have been taken
+        self.resend_after_home = set()
+        self.sent_targets = {}  # mkey -> last G message streamed
+
+    @log_exceptions
+    def prepare(self):
+        """Look up the motors and encode their commands ahead of time, start() then only has to send"""
+        for mkey, (pos, speed) in self.config['motors'].items():
+            if mkey not in self.motors:
+                continue
+            motor = self.motors[mkey]
+            self.resolved[mkey] = motor
+            if not (self.trajectory_config and self.trajectory_config.get('enabled')):
+                self.payloads[mkey] = motor.go_to_messages(pos, speed)
 
     @log_exceptions
     def start(self):
         if self.started:
             raise RuntimeError("Can only be started once")
-        self.started = time.time()
-        for mkey in self.config['motors'].keys():
-            if mkey not in self.motors:
-                self.logger.warning("Configured motor '{}' is NOT available".format(mkey))
-                continue
+        self.started = now_ns()
+        if self.trajectory_config and self.trajectory_config.get('enabled'):
+            return self._start_trajectory()
+        for mkey in self._available_targets().keys():
             motor = self.motors[mkey]
             pos, speed = self.config['motors'][mkey]
             if not motor.ready:
                 self.logger.warning("Motor '{}' is NOT ready".format(mkey))
-            motor.go_to(pos, speed)
+            if self.resolved.get(mkey) is motor and mkey in self.payloads:
+                motor.send_messages(self.payloads[mkey])
+            else:
+                # Motor (re)appeared after prepare()
+                motor.go_to(pos, speed)
+
+    def _available_targets(self):
+        """Targets for motors that are actually present, missing ones are skipped (and warned about once)"""
+        ret = {}
+        for mkey, target in self.config['motors'].items():
+            if mkey not in self.motors:
+                if mkey not in self.warned_missing:
+                    self.logger.warning("Configured motor '{}' is NOT available".format(mkey))
+                    self.warned_missing.add(mkey)
+                continue
+            ret[mkey] = target
+        return ret
+
+    @log_exceptions
+    def _start_trajectory(self):
+        """Start streaming setpoints along a profile that brings all motors to target simultaneously"""
+        targets = self._available_targets()
+        actual = {mkey: self.motors[mkey].current_pos for mkey in targets.keys()}
+        tolerance = self.trajectory_config.get('replan_tolerance', 1.0)
+        if (not self.plan
+                or any(abs(self.plan.profiles[mkey].start - actual[mkey]) > tolerance for mkey in targets.keys())):
+            self.logger.debug("Motors not where precomputed plan expects, replanning")
+            self.plan = plan_step(targets, actual, self.motors_config, self.trajectory_config)
+        self.logger.debug("Streaming trajectory, duration {:0.2f}s".format(self.plan.duration))
+        self.streaming = True
+        self._stream_tick()
+        self.streamer = PeriodicCallback(self._stream_tick, self.trajectory_config.get('stream_interval', 100))
+        self.streamer.start()
+
+    @log_exceptions
+    def _stream_tick(self):
+        """Send next setpoint to each motor, speed set so that it arrives there by the next tick.
+
+        Unchanged setpoints and speeds are not resent and at most trajectory_config['tx_budget'] frames go out per
+        tick, motors that did not fit go first on the next tick"""
+        if not self.streaming:
+            return
+        interval = self.trajectory_config.get('stream_interval', 100) / 1000
+        budget = self.trajectory_config.get('tx_budget')
+        if budget:
+            budget = max(budget, 2)  # one full F+G has to fit
+        elapsed = ns_to_s(now_ns() - self.started)
+        ahead = min(elapsed + interval, self.plan.duration)
+        mkeys = [mkey for mkey in self.plan.profiles.keys() if mkey in self.motors]
+        if mkeys:
+            self.stream_offset %= len(mkeys)
+            mkeys = mkeys[self.stream_offset:] + mkeys[:self.stream_offset]
+        moves = []
+        keys = {}
+        frames = 0
+        deferred = False
+        for idx, mkey in enumerate(mkeys):
+            profile = self.plan.profiles[mkey]
+            pos = profile.position(ahead)
+            velocity = abs(pos - profile.position(elapsed)) / interval
+            if ahead >= self.plan.duration:
+                # Final setpoint, make sure the exact target and the configured speed go out
+                pos = profile.end
+                velocity = max(velocity, profile.cruise_velocity)
+            motor = self.motors[mkey]
+            messages = motor.setpoint_messages(pos, speed_percent(velocity, self.motors_config))
+            if messages == [self.sent_targets.get(mkey)]:
+                continue
+            if budget and frames + len(messages) > budget:
+                self.stream_offset += idx
+                deferred = True
+                break
+            frames += len(messages)
+            moves.append((motor, messages))
+            keys[motor] = mkey
+        for motor, messages in transmit_moves(moves):
+            self.sent_targets[keys[motor]] = messages[-1]
+        if ahead >= self.plan.duration and not deferred:
+            self.stop_streaming()
+
+    @log_exceptions
+    def stop_streaming(self):
+        self.streaming = False
+        if self.streamer:
+            self.streamer.stop()
+            self.streamer = None
+
+    @log_exceptions
+    def cancel(self):
+        """Stop streaming and drop the pending dwell deadline"""
+        self.stop_streaming()
+        if self.deadline_handle:
+            IOLoop.current().remove_timeout(self.deadline_handle)
+            self.deadline_handle = None
+
+    def _waiting_for(self):
+        """Motors whose readiness this step depends on"""
+        ret = []
+        for mkey in self._available_targets().keys():
+            if mkey in self.skipped:
+                continue
+            if mkey in self.degraded:
+                if not self.motors[mkey].ready:
+                    continue
+                self.logger.info("Motor '{}' has recovered".format(mkey))
+                self.degraded.discard(mkey)
+            ret.append(mkey)
+        return ret
 
     @log_exceptions
     def _motors_done(self):
         ret = True
-        for mkey in self.config['motors'].keys():
-            if mkey not in self.motors:
-                self.logger.warning("Configured motor '{}' is NOT available".format(mkey))
-                continue
+        for mkey in self._waiting_for():
             if not self.motors[mkey].ready:
                 self.logger.debug("{} is NOT ready".format(mkey))
                 ret = False
@@ -60,16 +206,153 @@ class SequenceStep(LoggerMixin):
             self.logger.debug("{} is READY".format(mkey))
         return ret
 
+    def _expected_time(self, mkey, now):
+        """Seconds the move of given motor should still take from where it is now, 0 if we can't tell"""
+        expected = 0.0
+        if self.plan and mkey in self.plan.profiles:
+            expected = self.plan.duration - ns_to_s(now - self.started)
+        pos, speed = self.config['motors'][mkey]
+        if speed and self.motors_config:
+            # Speed 0 keeps whatever the node had, no telling how long that takes
+            distance = abs(pos - self.motors[mkey].current_pos)
+            expected = max(expected, distance / velocity_limit(speed, self.motors_config))
+        return expected
+
+    def _move_deadline(self, mkey, now):
+        """Deadline for the motor to become ready, expected move time stretched by timeout_factor plus
+        motor_timeout"""
+        expected = self._expected_time(mkey, now) * self.faults_config.get('timeout_factor', 1.5)
+        return now + int((expected + self.faults_config['motor_timeout']) * NS_PER_S)
+
+    @log_exceptions
+    def _check_faults(self):
+        """Apply the configured policy to motors that have not become ready in time, faults_config is dict
+        {
+            "motor_timeout": 30,  # seconds on top of the expected move time, also the time a motor gets after
+                                  # each time its position was seen changing
+            "timeout_factor": 1.5,  # expected move times (from speed and distance) are multiplied by this
+            "policy": ["retry", "rehome", "skip"],  # actions in order, then exhausted_action ("skip" or "abort")
+            "step_timeout": 120,  # seconds on top of the longest expected move for the whole step
+            "step_timeout_action": "skip"  # or "abort"
+        }"""
+        motor_timeout = self.faults_config.get('motor_timeout')
+        step_timeout = self.faults_config.get('step_timeout')
+        now = now_ns()
+        for mkey in list(self.resend_after_home):
+            motor = self.motors.get(mkey)
+            if not motor:
+                self.resend_after_home.discard(mkey)
+                continue
+            if motor.ready and not motor.homing:
+                self.logger.info("Motor '{}' re-homed, sending it to target again".format(mkey))
+                self.resend_after_home.discard(mkey)
+                motor.go_to(*self.config['motors'][mkey])
+                if motor_timeout:
+                    self.fault_deadlines[mkey] = self._move_deadline(mkey, now)
+        not_ready = [mkey for mkey in self._waiting_for() if not self.motors[mkey].ready]
+        if step_timeout and self.step_deadline is None:
+            longest = max([self._expected_time(mkey, now) for mkey in self._waiting_for()] or [0.0])
+            longest *= self.faults_config.get('timeout_factor', 1.5)
+            self.step_deadline = now + int((longest + step_timeout) * NS_PER_S)
+        if step_timeout and not_ready and now > self.step_deadline:
+            action = self._final_action('step_timeout_action')
+            self.logger.error("Step timed out waiting for {}, {}".format(", ".join(not_ready), action))
+            for mkey in not_ready:
+                self._fault_action(mkey, action)
+            return
+        if not motor_timeout:
+            return
+        for mkey in not_ready:
+            position = self.motors[mkey].current_pos
+            if mkey not in self.fault_deadlines:
+                self.fault_deadlines[mkey] = self._move_deadline(mkey, now)
+                self.fault_positions[mkey] = position
+                continue
+            if position != self.fault_positions[mkey]:
+                # Still making progress (or homing), it's not stuck
+                self.fault_positions[mkey] = position
+                self.fault_deadlines[mkey] = max(self.fault_deadlines[mkey], now + int(motor_timeout * NS_PER_S))
+            if now < self.fault_deadlines[mkey]:
+                continue
+            policy = self.faults_config.get('policy', ['skip'])
+            taken = self.fault_actions.get(mkey, 0)
+            action = policy[taken] if taken < len(policy) else self._final_action('exhausted_action')
+            self.fault_actions[mkey] = taken + 1
+            self.logger.error("Motor '{}' not ready and not moving, {}".format(mkey, action))
+            self._fault_action(mkey, action)
+            self.fault_deadlines[mkey] = self._move_deadline(mkey, now)
+
+    def _final_action(self, key):
+        """Action that settles the motor for good, only "skip" and "abort" do (others would repeat every tick)"""
+        action = self.faults_config.get(key, 'skip')
+        if action not in ('skip', 'abort'):
+            self.logger.warning("{} must be 'skip' or 'abort', not {}, skipping".format(key, repr(action)))
+            return 'skip'
+        return action
+
+    def _fault_action(self, mkey, action):
+        motor = self.motors[mkey]
+        if action == 'retry':
+            # The node answers the stop with an MS report that would make the motor look ready
+            motor.stop(ignore_report=True)
+            motor.go_to(*self.config['motors'][mkey])
+        elif action == 'rehome':
+            motor.home()
+            self.resend_after_home.add(mkey)
+        elif action == 'abort':
+            self.aborted = True
+        else:
+            # skip, continue without this motor and don't wait for it in the following steps either
+            self.skipped.add(mkey)
+            self.degraded.add(mkey)
+            self.resend_after_home.discard(mkey)
+
+    @log_exceptions
+    def motors_idle(self):
+        """Nothing moves during dwell, let the motors report less often"""
+        for mkey in self._available_targets().keys():
+            self.motors[mkey].report_idle()
+
+    def _motors_ready_since(self):
+        """When the last of our motors became ready, per their own status reports rather than when we noticed"""
+        ret = self.started
+        for mkey in self._waiting_for():
+            ret = max(ret, self.motors[mkey].ready_since)
+        return min(ret, now_ns())
+
+    @log_exceptions
+    def _deadline_reached(self):
+        """Dwell is over, don't wait for the next sequencer tick"""
+        self.deadline_handle = None
+        if self.wakeup:
+            self.wakeup()
+
     @log_exceptions
     def done(self):
+        if self.finished:
+            return True
+        if self.streaming:
+            self.logger.debug("Still streaming trajectory")
+            return False
+        if self.moved is None:
+            self._check_faults()
+        if self.aborted:
+            return False
         if not self._motors_done():
             self.logger.debug("Waiting for motors to be done")
             return False
-        if self.config['dwell'] > 0:
-            if not self.dwell_started:
+        if self.moved is None:
+            self.moved = self._motors_ready_since()
+            if self.config['dwell'] > 0:
                 self.logger.debug("Motors done, starting {:0.2f}s dwell".format(self.config['dwell']))
-                self.dwell_started = time.time()
-                return False
-            if (time.time() - self.dwell_started) < self.config['dwell']:
-                return False
+                self.dwell_deadline = self.moved + int(self.config['dwell'] * NS_PER_S)
+                self.motors_idle()
+                remaining = self.dwell_deadline - now_ns()
+                if remaining > 0:
+                    # IOLoop time is monotonic too, schedule for the absolute deadline
+                    loop = IOLoop.current()
+                    self.deadline_handle = loop.call_at(loop.time() + ns_to_s(remaining), self._deadline_reached)
+        if self.dwell_deadline and now_ns() < self.dwell_deadline:
+            return False
+        self.finished = now_ns()
         return True
@@ -0,0 +1,64 @@
+"""Monotonic clock helpers and statistics of planned vs achieved step timing"""
+import time
+
+NS_PER_S = 1000000000
+
+
+def now_ns():
+    """Monotonic nanoseconds, NTP or manual clock changes do not affect this"""
+    return time.monotonic_ns()
+
+
+def ns_to_s(value):
+    return value / NS_PER_S
+
+
+class RunningStat(object):
+    """Count, mean, min and max of a series without keeping the values"""
+    count = 0
+    total = 0.0
+    minimum = None
+    maximum = None
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'mean': (self.total / self.count) if self.count else None,
+            'min': self.minimum,
+            'max': self.maximum,
+            'total': self.total,
+        }
+
+
+class StepTimingStats(object):
+    """Collects planned vs achieved timing of finished steps, all values in milliseconds"""
+
+    def __init__(self):
+        self.stats = {
+            'move': RunningStat(),  # start to all motors done
+            'move_overrun': RunningStat(),  # move time minus planned trajectory duration
+            'dwell_overrun': RunningStat(),  # achieved minus planned dwell
+            'transition': RunningStat(),  # previous step finished to this step started
+        }
+
+    def add(self, name, value_ns):
+        self.stats[name].add(value_ns / 1000000)
+
+    def record_step(self, step, previous=None):
+        """Add timings of a finished step"""
+        self.add('move', step.moved - step.started)
+        if step.plan:
+            self.add('move_overrun', (step.moved - step.started) - step.plan.duration * NS_PER_S)
+        if step.config['dwell'] > 0:
+            self.add('dwell_overrun', (step.finished - step.moved) - step.config['dwell'] * NS_PER_S)
+        if previous and previous.finished:
+            self.add('transition', step.started - previous.finished)
+
+    def as_dict(self):
+        return {name: stat.as_dict() for name, stat in self.stats.items()}
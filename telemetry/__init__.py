@@ -0,0 +1,3 @@
+"""Binary log of radio traffic and tools to replay it"""
+from .log import TelemetryLog
+from .replay import TelemetryReplay
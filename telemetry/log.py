@@ -0,0 +1,112 @@
+import mmap
+import os
+import struct
+import threading
+import time
+
+from core.decorators import log_exceptions
+from core.mixins import LoggerMixin
+
+MAGIC = b'KTLM'
+VERSION = 1
+HEADER = struct.Struct('<4sHH8x')  # magic, version, record size
+# timestamp (ns since epoch), kind, node identifier, short addr, long addr, payload length, payload
+RECORD = struct.Struct('<qB20s2s8sB32s')
+
+KIND_RX = 1
+KIND_TX = 2
+KIND_NODE = 3
+KIND_NAMES = {
+    KIND_RX: 'rx',
+    KIND_TX: 'tx',
+    KIND_NODE: 'node',
+}
+
+
+class TelemetryLog(LoggerMixin, object):
+    """Append-only log of fixed size records in a preallocated memory-mapped file, rotated when full.
+
+    A record with zero timestamp marks the end of data, so a file cut short by a crash is still readable."""
+    path = None
+    max_size = 0
+    backups = 0
+    fp = None
+    mm = None
+    offset = 0
+
+    def __init__(self, path, *args, **kwargs):
+        self.max_size = kwargs.pop('max_size', 16 * 1024 * 1024)
+        self.backups = kwargs.pop('backups', 3)
+        super().__init__(*args, **kwargs)
+        self.path = path
+        self.lock = threading.Lock()
+        self.open()
+
+    def rotate_files(self):
+        """Shift path -> path.1 -> path.2 ..., dropping the oldest"""
+        for idx in range(self.backups, 0, -1):
+            src = self.path if idx == 1 else '{}.{}'.format(self.path, idx - 1)
+            if os.path.exists(src):
+                os.replace(src, '{}.{}'.format(self.path, idx))
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    @log_exceptions
+    def open(self):
+        """Start a fresh log file, existing one gets rotated so we never overwrite a previous run"""
+        self.rotate_files()
+        records = max((self.max_size - HEADER.size) // RECORD.size, 1)
+        size = HEADER.size + records * RECORD.size
+        self.fp = open(self.path, 'w+b')
+        self.fp.truncate(size)
+        self.mm = mmap.mmap(self.fp.fileno(), size)
+        HEADER.pack_into(self.mm, 0, MAGIC, VERSION, RECORD.size)
+        self.offset = HEADER.size
+        self.logger.info("Telemetry log {} opened, room for {} records".format(self.path, records))
+
+    @log_exceptions
+    def close(self):
+        with self.lock:
+            if self.mm:
+                self.mm.flush()
+                self.mm.close()
+                self.mm = None
+            if self.fp:
+                self.fp.close()
+                self.fp = None
+
+    def record(self, kind, node_identifier, short_addr, long_addr, payload):
+        """Append a record, called from both the xbee thread and the IOLoop"""
+        with self.lock:
+            if not self.mm:
+                return
+            if self.offset + RECORD.size > len(self.mm):
+                self.mm.close()
+                self.fp.close()
+                self.open()
+            RECORD.pack_into(
+                self.mm,
+                self.offset,
+                time.time_ns(),
+                kind,
+                node_identifier or b'',
+                short_addr or b'',
+                long_addr or b'',
+                min(len(payload), 32),
+                payload
+            )
+            self.offset += RECORD.size
+
+
+def read_records(path):
+    """Yield (timestamp_ns, kind, node_identifier, short_addr, long_addr, payload) tuples from a log file"""
+    with open(path, 'rb') as fp:
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magic, version, record_size = HEADER.unpack_from(mm, 0)
+            if magic != MAGIC or record_size != RECORD.size:
+                raise ValueError("{} is not a version {} telemetry log".format(path, VERSION))
+            for offset in range(HEADER.size, len(mm) - RECORD.size + 1, RECORD.size):
+                ts, kind, identifier, short_addr, long_addr, length, payload = RECORD.unpack_from(mm, offset)
+                if not ts:
+                    return
+                yield ts, kind, identifier.rstrip(b'\0'), short_addr, long_addr, payload[:length]
@@ -0,0 +1,127 @@
+"""Feed recorded radio traffic back through the xbee handler, usage: python3 -m telemetry.replay logfile [speed]
+
+speed 1 replays in real time, 10 ten times faster and 0 as fast as possible (for performance testing)"""
+import logging
+import sys
+import time
+
+from core.decorators import log_exceptions
+from core.mixins import LoggerMixin
+
+from .log import KIND_NODE, KIND_RX, read_records
+
+
+def record_to_packet(kind, identifier, short_addr, long_addr, payload):
+    """Rebuild the packet dict the xbee library would have given us, None for records that are not input"""
+    if kind == KIND_RX:
+        return {
+            'id': 'rx',
+            'source_addr': short_addr,
+            'source_addr_long': long_addr,
+            'rf_data': payload,
+        }
+    if kind == KIND_NODE:
+        return {
+            'id': 'node_id_indicator',
+            'node_id': identifier,
+            'source_addr': short_addr,
+            'source_addr_long': long_addr,
+        }
+    return None
+
+
+class TelemetryReplay(LoggerMixin, object):
+    """Schedules recorded frames on the IOLoop keeping their original spacing (divided by speed)"""
+    packets = []
+    handle = None
+    position = 0
+    stopped = False
+
+    def __init__(self, path, callback, mainloop, *args, **kwargs):
+        self.speed = kwargs.pop('speed', 1.0)
+        super().__init__(*args, **kwargs)
+        self.callback = callback
+        self.mainloop = mainloop
+        self.packets = []
+        for ts, kind, identifier, short_addr, long_addr, payload in read_records(path):
+            packet = record_to_packet(kind, identifier, short_addr, long_addr, payload)
+            if packet:
+                self.packets.append((ts, packet))
+        self.logger.info("Loaded {} frames from {}".format(len(self.packets), path))
+
+    @log_exceptions
+    def start(self):
+        self.position = 0
+        self.stopped = False
+        self.started = self.mainloop.time()
+        self._schedule()
+
+    @log_exceptions
+    def stop(self):
+        self.stopped = True
+        if self.handle:
+            self.mainloop.remove_timeout(self.handle)
+            self.handle = None
+
+    @property
+    def done(self):
+        return self.position >= len(self.packets)
+
+    def _schedule(self):
+        if self.done:
+            self.logger.info("Replay done")
+            return
+        if not self.speed:
+            # As fast as we can, but with a handle stop() can cancel (add_callback returns None)
+            self.handle = self.mainloop.call_later(0, self._feed)
+            return
+        elapsed_ns = self.packets[self.position][0] - self.packets[0][0]
+        self.handle = self.mainloop.call_at(self.started + elapsed_ns / 1e9 / self.speed, self._feed)
+
+    @log_exceptions
+    def _feed(self):
+        self.handle = None
+        if self.stopped:
+            return
+        _, packet = self.packets[self.position]
+        self.position += 1
+        self.callback(packet)
+        self._schedule()
+
+
+def main():
+    """Replay a log through an offline handler and report how long processing took"""
+    from tornado.ioloop import IOLoop
+
+    from xbeehandlers import xbee_handler
+
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    logging.basicConfig(level=logging.INFO)
+    speed = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    mainloop = IOLoop.current()
+    handler = xbee_handler(None, logger_name='replay')
+    replay = TelemetryReplay(sys.argv[1], handler.xbee_callback, mainloop, speed=speed, logger_name='replay')
+    cpu_started = time.process_time()
+    wall_started = time.time()
+
+    def check_done():
+        if replay.done:
+            mainloop.stop()
+            return
+        mainloop.call_later(0.1, check_done)
+
+    replay.start()
+    check_done()
+    mainloop.start()
+    print("{} frames, {:0.3f}s wall, {:0.3f}s CPU, {} nodes seen".format(
+        len(replay.packets),
+        time.time() - wall_started,
+        time.process_time() - cpu_started,
+        len(handler.nodes_by_identifier)
+    ))
+
+
+if __name__ == '__main__':
+    main()
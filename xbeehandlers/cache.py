@@ -0,0 +1,79 @@
+import binascii
+import json
+import os
+import time
+
+from core.decorators import log_exceptions
+from core.mixins import LoggerMixin
+
+
+class NodeCache(LoggerMixin, object):
+    """Persists the node table so that known nodes can be used right away after restart instead of waiting
+    for ND to complete, the file is JSON
+    {
+        "Motor1": {
+            "short_addr": "1a2b",
+            "long_addr": "0013a20040a1b2c3",
+            "seen": 1500000000.0
+        }
+    }
+    """
+    path = None
+    entries = {}
+
+    def __init__(self, path, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.path = path
+        self.entries = {}
+
+    @log_exceptions
+    def load(self):
+        """Read the cache file, returns list of (node_identifier, short_addr, long_addr) tuples"""
+        if not os.path.exists(self.path):
+            return []
+        try:
+            with open(self.path, 'rt') as fp:
+                self.entries = json.load(fp)
+        except ValueError:
+            self.logger.warning("Node cache {} is corrupt, ignoring it".format(self.path))
+            self.entries = {}
+            return []
+        ret = []
+        for identifier, entry in self.entries.items():
+            ret.append((
+                identifier.encode('utf-8'),
+                binascii.unhexlify(entry['short_addr']),
+                binascii.unhexlify(entry['long_addr']),
+            ))
+        return ret
+
+    @log_exceptions
+    def update(self, node):
+        """Store (or refresh) node and write the file if the addresses changed"""
+        identifier = node.node_identifier.decode('utf-8')
+        entry = {
+            'short_addr': binascii.hexlify(node.short_addr).decode('ascii'),
+            'long_addr': binascii.hexlify(node.long_addr).decode('ascii'),
+        }
+        old = self.entries.get(identifier, {})
+        changed = (old.get('short_addr'), old.get('long_addr')) != (entry['short_addr'], entry['long_addr'])
+        entry['seen'] = time.time()
+        self.entries[identifier] = entry
+        if changed:
+            self.save()
+
+    @log_exceptions
+    def remove(self, node_identifier):
+        """Invalidate single node"""
+        identifier = node_identifier.decode('utf-8')
+        if identifier in self.entries:
+            del self.entries[identifier]
+            self.save()
+
+    @log_exceptions
+    def save(self):
+        """Write the cache file, via a temporary file so a crash never leaves half a file behind"""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wt') as fp:
+            json.dump(self.entries, fp, indent=2)
+        os.replace(tmp_path, self.path)
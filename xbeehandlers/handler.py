@@ -1,11 +1,14 @@
 import binascii
+import logging
 import time
 
 from xbee import ZigBee
 
 from core.decorators import log_exceptions
 from core.mixins import LoggerMixin
+from telemetry.log import KIND_NODE, KIND_RX
 
+from .cache import NodeCache
 from .node import XbeeNode
 
 
@@ -15,22 +18,119 @@ class handler(LoggerMixin, object):
     nodes_by_shortaddr = {}
     xb = None
     new_node_callbacks = []
+    expired_node_callbacks = []
     last_discovery = 0
+    cache = None
+    telemetry = None
 
     def __init__(self, port, *args, **kwargs):
+        """port may be None for offline handler fed via xbee_callback (telemetry replay), or for handler talking
+        to the radio process via a RemoteXBee passed as xbee"""
         self.port = port
-        self.xb = ZigBee(
-            self.port,
-            callback=self.xbee_callback,
-            error_callback=self.error_callback,
-            escaped=False
-        )
+        self.xb = kwargs.pop('xbee', None)
+        cache_file = kwargs.pop('cache_file', None)
+        self.telemetry = kwargs.pop('telemetry', None)
+        # Instance copies, class level containers would be shared with handlers from previous reloads
+        self.nodes_by_identifier = {}
+        self.nodes_by_shortaddr = {}
+        self.new_node_callbacks = []
+        self.expired_node_callbacks = []
+        if self.port and not self.xb:
+            self.xb = ZigBee(
+                self.port,
+                callback=self.xbee_callback,
+                error_callback=self.error_callback,
+                escaped=False
+            )
         super().__init__(*args, **kwargs)
+        if cache_file:
+            self.cache = NodeCache(cache_file, logger_name=self.logger_name)
         self.discover_nodes()
 
+    @log_exceptions
+    def preload_cache(self):
+        """Bring up nodes from the cache file right away, discovery running in the background verifies them.
+        Call after registering new_node_callbacks"""
+        if not self.cache:
+            return
+        for identifier, short_addr, long_addr in self.cache.load():
+            if identifier in self.nodes_by_identifier:
+                # Discovery beat us to it
+                continue
+            self.logger.info("Preloading cached node {} at 0x{}".format(identifier, binascii.hexlify(short_addr)))
+            node = self.add_node(identifier, short_addr, long_addr, verified=False)
+            node.preloaded = time.time()
+
+    @log_exceptions
+    def expire_unverified(self, max_age):
+        """Forget cached nodes that have not shown up on the network within max_age seconds of preloading (and
+        at least one discovery since), returns list of their identifiers"""
+        ret = []
+        for identifier, node in list(self.nodes_by_identifier.items()):
+            if node.verified or self.last_discovery <= node.preloaded or time.time() - node.preloaded < max_age:
+                continue
+            self.logger.warning("Cached node {} did not answer, forgetting it".format(identifier))
+            del self.nodes_by_identifier[identifier]
+            self.nodes_by_shortaddr.pop(binascii.hexlify(node.short_addr), None)
+            if self.cache:
+                self.cache.remove(identifier)
+            for cb in self.expired_node_callbacks:
+                cb(node)
+            ret.append(identifier)
+        return ret
+
+    @log_exceptions
+    def add_node(self, identifier, short_addr, long_addr, verified=True):
+        """Register a node, known nodes are updated in place so motors built on them stay valid"""
+        sa_hex = binascii.hexlify(short_addr)
+        node = self.nodes_by_identifier.get(identifier)
+        if node and node.long_addr == long_addr:
+            old_sa_hex = binascii.hexlify(node.short_addr)
+            if old_sa_hex != sa_hex:
+                self.logger.info("Node {} moved from 0x{} to 0x{}".format(identifier, old_sa_hex, sa_hex))
+                self.nodes_by_shortaddr.pop(old_sa_hex, None)
+                node.short_addr = short_addr
+            self.nodes_by_shortaddr[sa_hex] = node
+            if verified and not node.verified:
+                self.logger.info("Cached node {} verified".format(identifier))
+                if self.telemetry:
+                    self.telemetry.record(KIND_NODE, node.node_identifier, short_addr, long_addr, b'')
+            node.verified = node.verified or verified
+            if self.cache and verified:
+                self.cache.update(node)
+            return node
+
+        if node:
+            # Same name, different radio, the old entry is no good anymore
+            self.logger.warning("Node {} replaced by a different radio".format(identifier))
+            self.nodes_by_shortaddr.pop(binascii.hexlify(node.short_addr), None)
+        node = XbeeNode(
+            self.xb,
+            short_addr=short_addr,
+            long_addr=long_addr,
+            node_identifier=identifier,
+            logger_name=self.logger_name
+        )
+        node.verified = verified
+        node.telemetry = self.telemetry
+        self.nodes_by_identifier[node.node_identifier] = node
+        self.nodes_by_shortaddr[sa_hex] = node
+        if self.cache and verified:
+            self.cache.update(node)
+
+        self.logger.info("New node {} at 0x{}".format(node.node_identifier, sa_hex))
+        if self.telemetry and verified:
+            self.telemetry.record(KIND_NODE, node.node_identifier, node.short_addr, node.long_addr, b'')
+        # Trigger callbacks registered for new nodes
+        for cb in self.new_node_callbacks:
+            cb(node)
+        return node
+
     @log_exceptions
     def xbee_callback(self, *args, **kwargs):
-        self.logger.debug("args: {} kwargs: {}".format(args, kwargs))
+        if self.logger.isEnabledFor(logging.DEBUG):
+            # Every status report passes here, don't format the packets for nothing
+            self.logger.debug("args: {} kwargs: {}".format(args, kwargs))
         packet = args[0]
 
         node_discovery_info = None
@@ -47,32 +147,48 @@ class handler(LoggerMixin, object):
                 and 'source_addr' in node_discovery_info
                 and 'source_addr_long' in node_discovery_info):
             # Node discovery packet
-            node = XbeeNode(
-                self.xb,
-                short_addr=node_discovery_info['source_addr'],
-                long_addr=node_discovery_info['source_addr_long'],
-                node_identifier=node_discovery_info['node_identifier'],
-                logger_name=self.logger_name
+            self.add_node(
+                node_discovery_info['node_identifier'],
+                node_discovery_info['source_addr'],
+                node_discovery_info['source_addr_long']
             )
-            self.nodes_by_identifier[node.node_identifier] = node
-            sa_hex = binascii.hexlify(node.short_addr)
-            self.nodes_by_shortaddr[sa_hex] = node
-
-            self.logger.info("New node {} at 0x{}".format(node.node_identifier, sa_hex))
-            # Trigger callbacks registered for new nodes
-            for cb in self.new_node_callbacks:
-                cb(node)
 
         if packet['id'] == 'rx':
             # Trigger node rx callbacks
             sa_hex = binascii.hexlify(packet['source_addr'])
+            if self.telemetry:
+                known = self.nodes_by_shortaddr.get(sa_hex)
+                self.telemetry.record(
+                    KIND_RX,
+                    known.node_identifier if known else None,
+                    packet['source_addr'],
+                    packet.get('source_addr_long'),
+                    packet['rf_data']
+                )
+            if sa_hex not in self.nodes_by_shortaddr:
+                self.readdress_node(packet)
             if sa_hex not in self.nodes_by_shortaddr:
                 self.logger.info("Got message from unkown node {}".format(sa_hex))
                 if time.time() - self.last_discovery > 5:
                     self.logger.debug("Triggering new node discovery")
                     self.discover_nodes()
             else:
-                self.nodes_by_shortaddr[sa_hex].rx(packet)
+                node = self.nodes_by_shortaddr[sa_hex]
+                if not node.verified:
+                    # Talking to us at the cached address is as good a verification as any
+                    self.add_node(node.node_identifier, node.short_addr, node.long_addr)
+                node.rx(packet)
+
+    @log_exceptions
+    def readdress_node(self, packet):
+        """Known node talking from a new short address (rejoined the network), the long address tells which one
+        it is so no need for a full discovery"""
+        if 'source_addr_long' not in packet:
+            return
+        for node in list(self.nodes_by_identifier.values()):
+            if node.long_addr == packet['source_addr_long']:
+                self.add_node(node.node_identifier, packet['source_addr'], node.long_addr)
+                return
 
     @log_exceptions
     def error_callback(self, *args):
@@ -84,12 +200,17 @@ class handler(LoggerMixin, object):
 
     @log_exceptions
     def quit(self, *args, **kwargs):
+        if not self.xb:
+            return
         self.xb.halt()
-        self.port.close()
+        if self.port:
+            self.port.close()
 
     @log_exceptions
     def discover_nodes(self):
         self.last_discovery = time.time()
+        if not self.xb:
+            return
         self.xb.at(command=b'ND')
 
     @log_exceptions
@@ -2,6 +2,7 @@ import struct
 
 from core.decorators import log_exceptions
 from core.mixins import LoggerMixin
+from telemetry.log import KIND_TX
 
 
 class XbeeNode(LoggerMixin):
@@ -12,6 +13,9 @@ class XbeeNode(LoggerMixin):
     xb = None  # xbee instance
     rx_callbacks = []
     alive = True
+    verified = True  # False for nodes loaded from cache until they've been seen on the network
+    preloaded = 0  # time.time() when loaded from cache
+    telemetry = None
 
     def __init__(self, xbee, *args, **kwargs):
         self.xb = xbee
@@ -34,6 +38,11 @@ class XbeeNode(LoggerMixin):
     def tx(self, *args):
         """Send data to target node, each argument is single byte to send (if you have a tuple/list mydata you can pass it as arguments with *mydata"""
         data_packed = struct.pack("%dB" % len(args), *args)
+        if self.telemetry:
+            self.telemetry.record(KIND_TX, self.node_identifier, self.short_addr, self.long_addr, data_packed)
+        if not self.xb:
+            self.logger.debug("{} is offline, not sending {}".format(self.node_identifier, data_packed))
+            return
         self.xb.tx(dest_addr=self.short_addr, dest_addr_long=self.long_addr, data=data_packed)
 
     @log_exceptions
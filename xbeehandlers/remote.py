@@ -0,0 +1,37 @@
+"""Plumbing for running the radio in a separate process (karactrl_radio.py), frames are msgpack over ZMQ"""
+import msgpack
+
+RX_TOPIC = 'rx'
+TX_TOPIC = 'tx'
+AT_TOPIC = 'at'
+
+
+def pack_frame(obj):
+    """Packets are dicts of str keys and bytes values (possibly nested), keep the two apart"""
+    return msgpack.packb(obj, use_bin_type=True)
+
+
+def unpack_frame(data):
+    try:
+        return msgpack.unpackb(data, raw=False)
+    except TypeError:
+        # msgpack < 0.5.2
+        return msgpack.unpackb(data, encoding='utf-8')
+
+
+class RemoteXBee(object):
+    """Stands in for xbee.ZigBee in the main process, tx and at commands are published to the radio process"""
+
+    def __init__(self, publish, socket_addr):
+        self.publish = publish
+        self.socket_addr = socket_addr
+
+    def tx(self, **kwargs):
+        self.publish(self.socket_addr, TX_TOPIC, pack_frame(kwargs))
+
+    def at(self, **kwargs):
+        self.publish(self.socket_addr, AT_TOPIC, pack_frame(kwargs))
+
+    def halt(self):
+        """Nothing to stop here, the radio process lives on its own"""
+        pass